@@ -0,0 +1,303 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import os
+import sqlite3
+
+import csv2celldl
+import sbgnml_extract
+
+# -----------------------------------------------------------------------------
+
+# Files that can be indexed, by the kind of diagram they hold
+
+SOURCE_KINDS = [('.sbgn', 'sbgn-ml'),
+                ('.sbgn.gz', 'sbgn-ml'),
+                ('.csv', 'connectivity'),
+               ]
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS diagrams (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        kind TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS elements (
+        id INTEGER PRIMARY KEY,
+        diagram INTEGER NOT NULL,
+        element_id TEXT NOT NULL,
+        guid TEXT,
+        label TEXT,
+        class TEXT,
+        compartment TEXT,
+        annotations TEXT
+    );
+    CREATE INDEX IF NOT EXISTS elements_diagram ON elements(diagram);
+    CREATE INDEX IF NOT EXISTS elements_element_id ON elements(element_id);
+    CREATE INDEX IF NOT EXISTS elements_guid ON elements(guid);
+    CREATE INDEX IF NOT EXISTS elements_label ON elements(label COLLATE NOCASE);
+    CREATE TABLE IF NOT EXISTS annotations (
+        element INTEGER NOT NULL,
+        predicate TEXT NOT NULL,
+        uri TEXT NOT NULL,
+        term TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS annotations_element ON annotations(element);
+    CREATE INDEX IF NOT EXISTS annotations_uri ON annotations(uri);
+    CREATE INDEX IF NOT EXISTS annotations_term ON annotations(term COLLATE NOCASE);
+    CREATE TABLE IF NOT EXISTS connections (
+        diagram INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        target TEXT NOT NULL,
+        type TEXT
+    );
+    CREATE INDEX IF NOT EXISTS connections_diagram ON connections(diagram);
+    CREATE INDEX IF NOT EXISTS connections_source ON connections(diagram, source);
+    CREATE INDEX IF NOT EXISTS connections_target ON connections(diagram, target);
+    CREATE VIRTUAL TABLE IF NOT EXISTS element_text USING fts5(
+        label, element_id, class, annotations, content='elements', content_rowid='id'
+    );
+'''
+
+DEFAULT_LIMIT = 100
+
+# -----------------------------------------------------------------------------
+
+def source_kind(path):
+    for (extension, kind) in SOURCE_KINDS:
+        if path.endswith(extension):
+            return kind
+    return None
+
+
+def uri_term(uri):
+    # The identifier at the end of a URI, e.g. ``GO:0060076`` or ``uniprot:P12345``
+    return uri.rstrip('/').rsplit('/', 1)[-1].rsplit('#', 1)[-1]
+
+# -----------------------------------------------------------------------------
+
+# Elements are ``(element_id, guid, label, class, compartment, annotations)``
+# tuples, with ``annotations`` a list of ``(predicate, uri)`` pairs, and
+# connections are ``(source, target, type)`` tuples of element ids.
+
+def sbgn_records(sbgn):
+    elements = []
+    for glyph in sbgn.glyphs:
+        annotations = [('bqmodel:isDerivedFrom', uri) for uri in glyph.derived_from]
+        if glyph.type is not None:
+            annotations.append(('bqbiol:is', glyph.type))
+        elements.append((glyph.id, glyph.guid, glyph.label, glyph.primary_class,
+                         glyph.parent.id if glyph.parent is not None else None,
+                         annotations))
+    connections = [(c.source.id, c.target.id, c.type) for c in sbgn.connections]
+    return (elements, connections)
+
+
+def network_records(network):
+    elements = []
+    root = network.root
+    for component in network.components:
+        group = component.group
+        elements.append((component.id, None, component.name,
+                         component.classes[0] if component.classes else None,
+                         group.id if group is not None and group is not root else None,
+                         []))
+    connections = [(s.source, s.target, s.type) for s in network.synapses]
+    return (elements, connections)
+
+
+def load_records(path, kind):
+    if kind == 'sbgn-ml':
+        # Conversion issues aren't of interest when indexing
+        return sbgn_records(sbgnml_extract.load_sbgnml(path, diagnostics=sbgnml_extract.Diagnostics()))
+    elif kind == 'connectivity':
+        return network_records(csv2celldl.load_network(path))
+    raise ValueError('Unknown kind of diagram: {}'.format(kind))
+
+# -----------------------------------------------------------------------------
+
+class DiagramIndex(object):
+    def __init__(self, database):
+        self._db = sqlite3.connect(database)
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _remove(self, diagram):
+        db = self._db
+        # Full-text entries are deleted by giving the values that were indexed
+        db.execute('''INSERT INTO element_text(element_text, rowid, label, element_id, class, annotations)
+                        SELECT 'delete', id, label, element_id, class, annotations
+                          FROM elements WHERE diagram = ?''', (diagram,))
+        db.execute('DELETE FROM annotations WHERE element IN (SELECT id FROM elements WHERE diagram = ?)',
+                   (diagram,))
+        db.execute('DELETE FROM elements WHERE diagram = ?', (diagram,))
+        db.execute('DELETE FROM connections WHERE diagram = ?', (diagram,))
+        db.execute('DELETE FROM diagrams WHERE id = ?', (diagram,))
+
+    def add(self, path, kind, records, mtime=None, size=None):
+        # Index an already converted diagram, replacing any earlier entry
+        path = os.path.abspath(path)
+        if mtime is None or size is None:
+            stat = os.stat(path)
+            (mtime, size) = (stat.st_mtime, stat.st_size)
+        (elements, connections) = records
+        with self._db as db:
+            row = db.execute('SELECT id FROM diagrams WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                self._remove(row[0])
+            diagram = db.execute('INSERT INTO diagrams(path, kind, mtime, size) VALUES (?, ?, ?, ?)',
+                                 (path, kind, mtime, size)).lastrowid
+            for (element_id, guid, label, cls, compartment, annotations) in elements:
+                uris = ' '.join(uri for (predicate, uri) in annotations)
+                element = db.execute('''INSERT INTO elements(diagram, element_id, guid, label, class,
+                                                           compartment, annotations)
+                                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                     (diagram, element_id, guid, label, cls, compartment, uris)).lastrowid
+                db.executemany('INSERT INTO annotations(element, predicate, uri, term) VALUES (?, ?, ?, ?)',
+                               [(element, predicate, uri, uri_term(uri)) for (predicate, uri) in annotations])
+                db.execute('''INSERT INTO element_text(rowid, label, element_id, class, annotations)
+                                VALUES (?, ?, ?, ?, ?)''', (element, label, element_id, cls, uris))
+            db.executemany('INSERT INTO connections(diagram, source, target, type) VALUES (?, ?, ?, ?)',
+                           [(diagram, source, target, type) for (source, target, type) in connections])
+
+    def _is_current(self, path, stat):
+        row = self._db.execute('SELECT mtime, size FROM diagrams WHERE path = ?', (path,)).fetchone()
+        return row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size
+
+    def update(self, paths):
+        # Index files (or the diagrams found under directories) that are new
+        # or have changed since they were last indexed. A file that can't be
+        # indexed doesn't stop the others being. Returns the paths indexed and
+        # ``(path, error)`` pairs for the files that failed.
+        indexed = []
+        failed = []
+        for path in self._source_files(paths):
+            path = os.path.abspath(path)
+            kind = source_kind(path)
+            if kind is None:
+                failed.append((path, 'not an SBGN-ML or connectivity file'))
+                continue
+            try:
+                stat = os.stat(path)
+                if not self._is_current(path, stat):
+                    self.add(path, kind, load_records(path, kind), stat.st_mtime, stat.st_size)
+                    indexed.append(path)
+            except Exception as error:
+                # What was indexed from an earlier version of the file is out of date
+                with self._db as db:
+                    row = db.execute('SELECT id FROM diagrams WHERE path = ?', (path,)).fetchone()
+                    if row is not None:
+                        self._remove(row[0])
+                failed.append((path, '{}: {}'.format(type(error).__name__, error)))
+        return (indexed, failed)
+
+    @staticmethod
+    def _source_files(paths):
+        for path in paths:
+            if os.path.isdir(path):
+                for (directory, _, filenames) in os.walk(path):
+                    for filename in sorted(filenames):
+                        if source_kind(filename) is not None:
+                            yield os.path.join(directory, filename)
+            else:
+                yield path
+
+    def prune(self):
+        # Forget diagrams whose files no longer exist
+        removed = []
+        with self._db:
+            for (diagram, path) in self._db.execute('SELECT id, path FROM diagrams').fetchall():
+                if not os.path.exists(path):
+                    self._remove(diagram)
+                    removed.append(path)
+        return removed
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        # Matches annotation URIs and terms (e.g. ``GO:0060076``), element ids
+        # and SBGN ids, and, through full-text search, labels and classes. Results are
+        # ``(path, element_id, label, class)`` tuples.
+        phrase = '"{}"'.format(query.replace('"', '""'))
+        return self._db.execute('''
+            SELECT d.path, e.element_id, e.label, e.class
+              FROM elements e JOIN diagrams d ON d.id = e.diagram
+             WHERE e.id IN (SELECT element FROM annotations WHERE uri = :query OR term = :query COLLATE NOCASE
+                            UNION SELECT id FROM elements WHERE element_id = :query OR guid = :query
+                            UNION SELECT rowid FROM element_text WHERE element_text MATCH :phrase)
+             ORDER BY d.path, e.element_id
+             LIMIT :limit''', dict(query=query, phrase=phrase, limit=limit)).fetchall()
+
+    def connections(self, path, element_id):
+        # The ``(source, target, type)`` connections of an element in a diagram
+        return self._db.execute('''
+            SELECT c.source, c.target, c.type
+              FROM connections c JOIN diagrams d ON d.id = c.diagram
+             WHERE d.path = :path AND (c.source = :id OR c.target = :id)''',
+                                dict(path=os.path.abspath(path), id=element_id)).fetchall()
+
+# -----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Index converted diagrams for fast lookup.')
+    parser.add_argument('database', metavar='DATABASE',
+                        help='the SQLite index')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    index_command = commands.add_parser('index', help='index new and changed diagrams')
+    index_command.add_argument('paths', metavar='PATH', nargs='+',
+                               help='SBGN-ML or connectivity CSV files, or directories of them')
+    index_command.add_argument('--prune', action='store_true',
+                               help='also forget diagrams whose files have been deleted')
+    search_command = commands.add_parser('search', help='find diagrams containing a term')
+    search_command.add_argument('query', metavar='QUERY',
+                                help='an annotation URI or term, element id, or text in labels')
+    search_command.add_argument('--limit', metavar='N', type=int, default=DEFAULT_LIMIT,
+                                help='maximum number of results (default: %(default)s)')
+    args = parser.parse_args()
+
+    with DiagramIndex(args.database) as index:
+        if args.command == 'index':
+            (indexed, failed) = index.update(args.paths)
+            for path in indexed:
+                print('indexed', path)
+            for (path, error) in failed:
+                print('failed', path, error, file=sys.stderr)
+            if args.prune:
+                for path in index.prune():
+                    print('removed', path)
+            if failed:
+                sys.exit(1)
+        elif args.command == 'search':
+            for (path, element_id, label, cls) in index.search(args.query, args.limit):
+                print('\t'.join([path, element_id, label or '', cls or '']))
+
+# -----------------------------------------------------------------------------
@@ -0,0 +1,472 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import io
+import json
+from lxml import etree
+import re
+from xml.sax.saxutils import escape
+
+# -----------------------------------------------------------------------------
+
+INDENT = 4
+
+# -----------------------------------------------------------------------------
+
+COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+RULE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+LENGTH = re.compile(r'^\s*(-?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)\s*([a-z%]*)\s*$')
+SIMPLE_SELECTOR = re.compile(r'([#.]?)([-_a-zA-Z0-9]+|\*)')
+
+# -----------------------------------------------------------------------------
+
+def parse_lengths(value):
+    # '49.17%, 31.68%' --> [(49.17, '%'), (31.68, '%')]
+    lengths = []
+    for part in value.split(','):
+        match = LENGTH.match(part)
+        if match is None:
+            return None
+        lengths.append((float(match.group(1)), match.group(2)))
+    return lengths
+
+# -----------------------------------------------------------------------------
+
+class Selector(object):
+    def __init__(self, text):
+        self._text = text.strip()
+        # A list of (combinator, tag, classes, id) from right to left
+        self._parts = []
+        combinator = None
+        for token in reversed(self._text.replace('>', ' > ').split()):
+            if token == '>':
+                combinator = '>'
+                continue
+            tag = None
+            classes = []
+            id = None
+            for (prefix, name) in SIMPLE_SELECTOR.findall(token):
+                if prefix == '#':
+                    id = name
+                elif prefix == '.':
+                    classes.append(name)
+                elif name != '*':
+                    tag = name
+            self._parts.append((combinator, tag, classes, id))
+            combinator = ' '
+        ids = sum(1 for p in self._parts if p[3] is not None)
+        classes = sum(len(p[2]) for p in self._parts)
+        tags = sum(1 for p in self._parts if p[1] is not None)
+        self._specificity = (ids, classes, tags)
+
+    def __str__(self):
+        return self._text
+
+    @property
+    def specificity(self):
+        return self._specificity
+
+    @property
+    def id(self):
+        # The id of a selector that only picks out a single element
+        if len(self._parts) == 1 and not self._parts[0][2] and self._parts[0][1] is None:
+            return self._parts[0][3]
+
+    @staticmethod
+    def _matches_element(part, element):
+        (_, tag, classes, id) = part
+        return ((tag is None or tag == element.tag)
+            and (id is None or id == element.id)
+            and all(c in element.classes for c in classes))
+
+    def matches(self, element):
+        if not self._parts or not self._matches_element(self._parts[0], element):
+            return False
+        return self._matches_ancestors(1, element.parent)
+
+    def _matches_ancestors(self, index, element):
+        if index >= len(self._parts):
+            return True
+        part = self._parts[index]
+        while element is not None:
+            if self._matches_element(part, element):
+                if self._matches_ancestors(index+1, element.parent):
+                    return True
+            if part[0] == '>':
+                return False
+            element = element.parent
+        return False
+
+# -----------------------------------------------------------------------------
+
+class StyleRule(object):
+    def __init__(self, selectors, declarations, order):
+        self._selectors = [Selector(s) for s in selectors.split(',') if s.strip()]
+        self._declarations = declarations
+        self._order = order
+
+    @property
+    def selectors(self):
+        return self._selectors
+
+    @property
+    def declarations(self):
+        return self._declarations
+
+    @property
+    def order(self):
+        return self._order
+
+    def to_celldl(self, level=0):
+        indent = INDENT*level*' '
+        style = ['{}{} {{'.format(indent, ', '.join(str(s) for s in self._selectors))]
+        for name, value in self._declarations.items():
+            style.append('{}{}: {};'.format(indent + INDENT*' ', name, value))
+        style.append('{}}}'.format(indent))
+        return '\n'.join(style)
+
+    @staticmethod
+    def parse(text, first_order=0):
+        rules = []
+        for (selectors, body) in RULE.findall(COMMENT.sub('', text)):
+            declarations = {}
+            for declaration in body.split(';'):
+                if ':' in declaration:
+                    (name, value) = declaration.split(':', 1)
+                    declarations[name.strip()] = value.strip()
+            rules.append(StyleRule(selectors, declarations, first_order + len(rules)))
+        return rules
+
+# -----------------------------------------------------------------------------
+
+class Element(object):
+    def __init__(self, tag, attributes, parent=None):
+        self._tag = tag
+        self._attributes = attributes
+        self._classes = attributes.get('class', '').split()
+        self._parent = parent
+        self._style = {}
+
+    @property
+    def tag(self):
+        return self._tag
+
+    @property
+    def id(self):
+        return self._attributes.get('id')
+
+    @property
+    def classes(self):
+        return self._classes
+
+    @property
+    def attributes(self):
+        return self._attributes
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @property
+    def style(self):
+        return self._style
+
+    def set_style(self, style):
+        self._style = style
+
+    def _attribute_text(self):
+        return ' '.join('{}="{}"'.format(name, escape(value, {'"': '&quot;'}))
+                            for name, value in self._attributes.items())
+
+# -----------------------------------------------------------------------------
+
+class Component(Element):
+    def __init__(self, attributes, parent=None):
+        super().__init__('component', attributes, parent)
+        self._children = []
+
+    @property
+    def label(self):
+        return self._attributes.get('label', '')
+
+    @property
+    def children(self):
+        return self._children
+
+    @property
+    def position(self):
+        return parse_lengths(self._style['position']) if 'position' in self._style else None
+
+    @property
+    def size(self):
+        return parse_lengths(self._style['size']) if 'size' in self._style else None
+
+    def add_child(self, child):
+        self._children.append(child)
+
+    def to_celldl(self, level=0):
+        indent = INDENT*level*' '
+        if len(self._children) == 0:
+            return '{}<component {}/>'.format(indent, self._attribute_text())
+        else:
+            celldl = ['{}<component {}>'.format(indent, self._attribute_text())]
+            for c in self._children:
+                celldl.append(c.to_celldl(level+1))
+            celldl.append('{}</component>'.format(indent))
+            return '\n'.join(celldl)
+
+# -----------------------------------------------------------------------------
+
+class Connection(Element):
+    def __init__(self, attributes, parent=None):
+        super().__init__('connection', attributes, parent)
+
+    @property
+    def source(self):
+        return self._attributes.get('from')
+
+    @property
+    def target(self):
+        return self._attributes.get('to')
+
+    def to_celldl(self, level=0):
+        indent = INDENT*level*' '
+        return '{}<connection {}/>'.format(indent, self._attribute_text())
+
+# -----------------------------------------------------------------------------
+
+# The regions of a background place components over parts of its image
+
+class Background(Element):
+    def __init__(self, attributes):
+        super().__init__('background', attributes)
+        self._regions = []
+
+    @property
+    def regions(self):
+        return self._regions
+
+    def add_region(self, attributes):
+        self._regions.append(Element('region', attributes, self))
+
+    def to_celldl(self, level=0):
+        indent = INDENT*level*' '
+        if len(self._regions) == 0:
+            return '{}<background {}/>'.format(indent, self._attribute_text())
+        else:
+            celldl = ['{}<background {}>'.format(indent, self._attribute_text())]
+            for r in self._regions:
+                celldl.append('{}<region {}/>'.format(INDENT*(level+1)*' ', r._attribute_text()))
+            celldl.append('{}</background>'.format(indent))
+            return '\n'.join(celldl)
+
+# -----------------------------------------------------------------------------
+
+class CellDiagram(object):
+    def __init__(self):
+        self._background = None
+        self._components = []
+        self._components_by_id = {}
+        self._root_components = []
+        self._connections = []
+        self._rules = []
+
+    @property
+    def background(self):
+        return self._background
+
+    @property
+    def components(self):
+        return self._components
+
+    @property
+    def root_components(self):
+        return self._root_components
+
+    @property
+    def connections(self):
+        return self._connections
+
+    @property
+    def rules(self):
+        return self._rules
+
+    @property
+    def size(self):
+        # The size given by the ``cell-diagram`` style rule, in pixels
+        style = {}
+        for rule in self._rules:
+            if any(str(s) == 'cell-diagram' for s in rule.selectors):
+                style.update(rule.declarations)
+        if 'width' in style and 'height' in style:
+            return (parse_lengths(style['width'])[0][0], parse_lengths(style['height'])[0][0])
+
+    def component(self, id):
+        return self._components_by_id.get(id)
+
+    def _add_component(self, component):
+        self._components.append(component)
+        if component.id is not None and component.id not in self._components_by_id:
+            self._components_by_id[component.id] = component
+        if component.parent is None:
+            self._root_components.append(component)
+        else:
+            component.parent.add_child(component)
+
+    def _apply_style(self):
+        # Rules with an id selector only ever apply to that element, so are
+        # looked up directly rather than matched against every element
+        id_rules = {}
+        other_rules = []
+        for rule in self._rules:
+            for selector in rule.selectors:
+                if selector.id is not None:
+                    id_rules.setdefault(selector.id, []).append((selector, rule))
+                else:
+                    other_rules.append((selector, rule))
+        for element in self._components + self._connections:
+            matched = [(s.specificity, r.order, r) for (s, r) in other_rules if s.matches(element)]
+            matched.extend((s.specificity, r.order, r) for (s, r) in id_rules.get(element.id, []))
+            style = {}
+            for (_, _, rule) in sorted(matched, key=lambda m: m[:2]):
+                style.update(rule.declarations)
+            element.set_style(style)
+
+    def validate(self):
+        issues = []
+        ids = set()
+        for c in self._components:
+            if c.id is None:
+                issues.append('Component without an id')
+            elif c.id in ids:
+                issues.append('Duplicate component id ({})'.format(c.id))
+            else:
+                ids.add(c.id)
+        for c in self._connections:
+            if c.source not in ids:
+                issues.append('Connection has unknown source ({})'.format(c.source))
+            if c.target not in ids:
+                issues.append('Connection has unknown target ({})'.format(c.target))
+        return issues
+
+    def to_celldl(self):
+        celldl = ['<cell-diagram>']
+        if self._background is not None:
+            celldl.append(self._background.to_celldl(1))
+        celldl.append('{}<flat-map>'.format(INDENT*' '))
+        for c in self._root_components:
+            celldl.append(c.to_celldl(2))
+        for c in self._connections:
+            celldl.append(c.to_celldl(2))
+        celldl.append('{}</flat-map>'.format(INDENT*' '))
+        celldl.append('{}<style>'.format(INDENT*' '))
+        for rule in self._rules:
+            celldl.append(rule.to_celldl(2))
+        celldl.append('{}</style>'.format(INDENT*' '))
+        celldl.append('</cell-diagram>')
+        return '\n'.join(celldl)
+
+    def to_json(self):
+        return { 'components': [dict(id=c.id, label=c.label, classes=c.classes,
+                                     parent=c.parent.id if c.parent is not None else None,
+                                     position=c.position, size=c.size)
+                                    for c in self._components],
+                 'connections': [dict(source=c.source, target=c.target, classes=c.classes)
+                                    for c in self._connections],
+                 'size': self.size,
+               }
+
+# -----------------------------------------------------------------------------
+
+def read(source):
+    # ``source`` is a filename or a binary file object. Elements are parsed
+    # incrementally and discarded once read so memory use stays small.
+    diagram = CellDiagram()
+    in_flat_map = False
+    components = []
+    for (event, element) in etree.iterparse(source, events=('start', 'end'),
+                                            remove_comments=True):
+        tag = etree.QName(element).localname
+        if event == 'start':
+            if tag == 'flat-map':
+                in_flat_map = True
+            elif in_flat_map and tag == 'component':
+                component = Component(dict(element.attrib),
+                                      components[-1] if components else None)
+                diagram._add_component(component)
+                components.append(component)
+            elif in_flat_map and tag == 'connection':
+                diagram._connections.append(Connection(dict(element.attrib)))
+            elif tag == 'background':
+                diagram._background = Background(dict(element.attrib))
+            elif (tag == 'region' and diagram._background is not None
+              and etree.QName(element.getparent()).localname == 'background'):
+                diagram._background.add_region(dict(element.attrib))
+        else:
+            if tag == 'flat-map':
+                in_flat_map = False
+            elif in_flat_map and tag == 'component':
+                components.pop()
+            elif tag == 'style':
+                diagram._rules.extend(StyleRule.parse(element.text or '', len(diagram._rules)))
+            if tag != 'cell-diagram' and element.getparent() is not None and not components:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+    diagram._apply_style()
+    return diagram
+
+
+def read_string(text):
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return read(io.BytesIO(text))
+
+# -----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Read and check CellDL files.')
+    parser.add_argument('celldl_files', metavar='CELLDL_FILE', nargs='+',
+                        help='the CellDL files to read')
+    parser.add_argument('--json', action='store_true',
+                        help='print each diagram as JSON')
+    args = parser.parse_args()
+
+    valid = True
+    for filename in args.celldl_files:
+        diagram = read(filename)
+        issues = diagram.validate()
+        if args.json:
+            print(json.dumps(diagram.to_json(), sort_keys=True,
+                             indent=INDENT, separators=(',', ': ')))
+        print('{}: {} components, {} connections, {} style rules'.format(filename,
+              len(diagram.components), len(diagram.connections), len(diagram.rules)),
+              file=sys.stderr)
+        for issue in issues:
+            print('    {}'.format(issue), file=sys.stderr)
+        if issues:
+            valid = False
+    if not valid:
+        sys.exit(1)
+
+# -----------------------------------------------------------------------------
@@ -18,9 +18,20 @@
 #
 # -----------------------------------------------------------------------------
 
+from concurrent.futures import ThreadPoolExecutor
 import csv
 import json
 import networkx as nx
+import os
+
+import svg_render
+
+# Binary adjacency export is optional and needs NumPy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # -----------------------------------------------------------------------------
 
@@ -104,6 +115,23 @@ MAX_POS = 95
 
 INDENT = 4
 
+OUTPUT_FORMATS = ['celldl', 'json', 'neurons', 'svg']
+
+# Formats written as a set of files
+
+FILE_SET_FORMATS = ['csr', 'overview', 'tiles']
+
+# The arrays of a compressed sparse row export, each in ``<name>.npy``
+
+CSR_ARRAYS = ['indptr', 'indices', 'edge_type', 'weight', 'edge_types', 'neurons']
+
+FILE_EXTENSIONS = {
+    'celldl': '.celldl',
+    'json': '.json',
+    'neurons': '.neurons.txt',
+    'svg': '.svg',
+}
+
 DEFAULT_SIZES = {
     'compartment': (25, 25),
     'neuron': (6, 4),
@@ -148,6 +176,28 @@ DEFAULT_STYLE_RULES = """
 """.format(DEFAULT_SIZES['compartment'][0], DEFAULT_SIZES['compartment'][1],
            DEFAULT_SIZES['neuron'][0], DEFAULT_SIZES['neuron'][1])
 
+# Stubs stand in for the remote end of a connection that crosses tiles
+
+STUB_STYLE_RULES = """
+        .stub {
+            opacity: 0.4;
+            size: 2v, 2v;
+        }
+"""
+
+# -----------------------------------------------------------------------------
+
+def celldl_document(flat_map, style):
+    celldl = ['<cell-diagram>']
+    celldl.append('{}<flat-map>'.format(INDENT*' '))
+    celldl.extend(flat_map)
+    celldl.append('{}</flat-map>'.format(INDENT*' '))
+    celldl.append('{}<style>'.format(INDENT*' '))
+    celldl.append(style)
+    celldl.append('{}</style>'.format(INDENT*' '))
+    celldl.append('</cell-diagram>')
+    return '\n'.join(celldl)
+
 # -----------------------------------------------------------------------------
 
 class Component(object):
@@ -165,6 +215,14 @@ class Component(object):
     def id(self):
         return self._id
 
+    @property
+    def group(self):
+        return self._group
+
+    @property
+    def classes(self):
+        return self._classes
+
     def set_group(self, group):
         self._group = group
         if group:
@@ -172,17 +230,30 @@ class Component(object):
             if len(group._classes):
                 self._classes.append(group._classes[0])
 
-    def _attributes(self):
+    def _attributes(self, extra_classes=None, tile=None):
         attribs = ['id="{}"'.format(self.id),
                    'label="{}"'.format(self.name)]
-        if len(self._classes):
-            attribs.append('class="{}"'.format(' '.join(self._classes)))
+        classes = self._classes + extra_classes if extra_classes else self._classes
+        if len(classes):
+            attribs.append('class="{}"'.format(' '.join(classes)))
+        if tile is not None:
+            attribs.append('tile="{}"'.format(tile))
         return ' '.join(attribs)
 
-    def to_celldl(self, level):
+    def subtree(self):
+        yield self
+
+    def to_celldl(self, level, selection=None):
         indent = INDENT*level*' '
         return '{}<component {}/>'.format(indent, self._attributes())
 
+    def to_tile_reference(self, level, tile, stub=False):
+        indent = INDENT*level*' '
+        return '{}<component {}/>'.format(indent, self._attributes(['stub'] if stub else None, tile))
+
+    def to_overview_celldl(self, level, depth, detail=None):
+        return self.to_celldl(level)
+
     def to_json(self):
         j = {'name': self._name,
              'id': self._id
@@ -211,18 +282,41 @@ class Group(Component):
     def add(self, component):
         self._components.append(component)
 
-    def to_celldl(self, level):
+    def subtree(self):
+        yield self
+        for c in self._components:
+            yield from c.subtree()
+
+    def to_celldl(self, level, selection=None):
         indent = INDENT*level*' '
-        self._classes.append('compartment')
+        attributes = self._attributes(['compartment'])
         if len(self._components) == 0:
-            return '{}<component {}/>'.format(indent, self._attributes())
+            return '{}<component {}/>'.format(indent, attributes)
         else:
-            celldl = ['{}<component {}>'.format(indent, self._attributes())]
+            celldl = ['{}<component {}>'.format(indent, attributes)]
             for c in self._components:
-                celldl.append(c.to_celldl(level+1))
+                if selection is None or c in selection:
+                    celldl.append(c.to_celldl(level+1, selection))
             celldl.append('{}</component>'.format(indent))
             return '\n'.join(celldl)
 
+    def to_tile_reference(self, level, tile, stub=False):
+        indent = INDENT*level*' '
+        classes = ['compartment', 'stub'] if stub else ['compartment']
+        return '{}<component {}/>'.format(indent, self._attributes(classes, tile))
+
+    def to_overview_celldl(self, level, depth, detail=None):
+        # Below ``depth`` our components are collapsed into us, linking to
+        # the detailed diagram
+        if len(self._components) == 0 or depth <= 0:
+            return self.to_tile_reference(level, detail if self._components else None)
+        indent = INDENT*level*' '
+        celldl = ['{}<component {}>'.format(indent, self._attributes(['compartment']))]
+        for c in self._components:
+            celldl.append(c.to_overview_celldl(level+1, depth-1, detail))
+        celldl.append('{}</component>'.format(indent))
+        return '\n'.join(celldl)
+
 # -----------------------------------------------------------------------------
 
 class Groups(object):
@@ -239,11 +333,16 @@ class Groups(object):
         for g in self._groups.values():
             g.set_group(self.group(g.name))
 
+    @property
+    def groups(self):
+        return list(self._groups.values())
+
     def group(self, name):
         return self._groups.get(self._groups_by_name.get(name), self._root)
 
     def root(self):
         return self._root
+
         '''
         flat_graph = nx.DiGraph()
         for g in self._groups.values():
@@ -257,23 +356,58 @@ class Groups(object):
         #return next(nx.topological_sort(flat_graph))
         '''
 
-    def to_celldl(self, level):
-        return '\n'.join([c.to_celldl(level) for c in self._root._components])
+    def top_level(self, component):
+        while component.group is not None and component.group is not self._root:
+            component = component.group
+        return component
 
-    def to_json(self):
-        return [g.to_json() for g in self._groups.values()]
+    def to_celldl(self, level, selection=None):
+        return '\n'.join([c.to_celldl(level, selection) for c in self._root._components
+                                                         if selection is None or c in selection])
+
+    def to_json(self, selection=None):
+        return [g.to_json() for g in self._groups.values() if selection is None or g in selection]
+
+# -----------------------------------------------------------------------------
+
+def synaptic_strength(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
 
 # -----------------------------------------------------------------------------
 
 class Synapse(object):
-    def __init__(self, source, target, type):
+    def __init__(self, source, target, type, strength=None):
         self._source = source
         self._target = target
         self._type = type
+        self._strength = strength
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def strength(self):
+        return self._strength
+
+    @property
+    def connection_class(self):
+        return self._type.split('_')[0] if self._type else None
 
     def to_celldl(self, level=0):
         indent = INDENT*level*' '
-        cls = ' class="{}"'.format(self._type.split('_')[0]) if self._type else ''
+        cls = ' class="{}"'.format(self.connection_class) if self._type else ''
         return '{}<connection from="{}" to="{}"{}/>'.format(indent, self._source, self._target, cls)
 
     def to_json(self):
@@ -284,23 +418,79 @@ class Synapse(object):
 
 # -----------------------------------------------------------------------------
 
+# Stands for all of the synapses of a class between what two supernodes of an
+# overview contain, with the number of synapses and their total strength
+
+class OverviewSynapse(Synapse):
+    def __init__(self, source, target, type):
+        super().__init__(source, target, type)
+        self._count = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    def add(self, synapse):
+        self._count += 1
+        if synapse.strength is not None:
+            self._strength = (self._strength or 0) + synapse.strength
+
+    def to_celldl(self, level=0):
+        indent = INDENT*level*' '
+        cls = ' class="{}"'.format(self.connection_class) if self._type else ''
+        strength = ' strength="{:g}"'.format(self._strength) if self._strength is not None else ''
+        return '{}<connection from="{}" to="{}"{} count="{}"{}/>'.format(indent,
+            self._source, self._target, cls, self._count, strength)
+
+    def to_json(self):
+        j = super().to_json()
+        j['count'] = self._count
+        j['strength'] = round(self._strength, 6) if self._strength is not None else None
+        return j
+
+# -----------------------------------------------------------------------------
+
+class Selection(object):
+    def __init__(self, components, connections):
+        self._components = components
+        self._connections = connections
+
+    def __contains__(self, component):
+        return component in self._components
+
+    def __len__(self):
+        return len(self._components)
+
+    @property
+    def connections(self):
+        return self._connections
+
+# -----------------------------------------------------------------------------
+
 class NeuralNetwork(object):
     def __init__(self, csv_dict_reader):
         self._neurons = {}
         self._next_neuron_id = 1
         self._synapses = []
+        self._adjacency = None
         self._groups = Groups(RESPIRATORY_GROUP_BY_NAME)
         for row in csv_dict_reader:
             source = self.add_neuron(row['Source population'])
             target = self.add_neuron(row['Target population'])
-            self._synapses.append(Synapse(source.id, target.id, row['Synaptic type']))
+            self._synapses.append(Synapse(source.id, target.id, row['Synaptic type'],
+                                          synaptic_strength(row.get('Synaptic strength'))))
 
-    def add_neuron(self, name):
+    @staticmethod
+    def clean_name(name):
         # A 'minus' sign is encoded in many different ways...
         name = name.replace(u'\u2212', '-').replace(u'\u2013', '-')
         # Clean up duplicate names for same neuron
         if name == 'E-Dec-T':
             name = 'E-Dec-Tonic'
+        return name
+
+    def add_neuron(self, name):
+        name = self.clean_name(name)
         if name not in self._neurons:
             neuron = Neuron(name, self._next_neuron_id, self._groups.group(name))
             self._neurons[name] = neuron
@@ -309,61 +499,399 @@ class NeuralNetwork(object):
             neuron = self._neurons[name]
         return neuron
 
+    @property
+    def components(self):
+        return self._groups.groups + list(self._neurons.values())
+
+    @property
+    def synapses(self):
+        return self._synapses
+
+    @property
+    def root(self):
+        return self._groups.root()
+
     def neurons(self):
         return '\n'.join(sorted(self._neurons.keys()))
 
-    def to_celldl(self):
-        celldl = ['<cell-diagram>']
-        celldl.append('{}<flat-map>'.format(INDENT*' '))
-        celldl.append(self._groups.to_celldl(2))
+    def _adjacent(self, neuron):
+        # The index is only published once complete as other threads may be reading
+        adjacency = self._adjacency
+        if adjacency is None:
+            components = {n.id: n for n in self._neurons.values()}
+            adjacency = {}
+            for s in self._synapses:
+                source = components[s.source]
+                target = components[s.target]
+                adjacency.setdefault(source, []).append((target, s))
+                adjacency.setdefault(target, []).append((source, s))
+            self._adjacency = adjacency
+        return adjacency.get(neuron, [])
+
+    def neighbourhood(self, names, hops=1, classes=None, types=None):
+        # The neurons within ``hops`` synapses of the named populations (or
+        # neuron ids), along with their groups. ``classes`` limits the neurons
+        # reached and ``types`` the synapses followed, given as either full
+        # synaptic types or their class (e.g. ``ex``).
+        def followed(synapse):
+            return types is None or synapse.type in types or synapse.connection_class in types
+
+        neurons_by_id = None
+        selection = set()
+        for name in names:
+            neuron = self._neurons.get(self.clean_name(name))
+            if neuron is None:
+                if neurons_by_id is None:
+                    neurons_by_id = {n.id: n for n in self._neurons.values()}
+                neuron = neurons_by_id.get(name)
+            if neuron is not None:
+                selection.add(neuron)
+        frontier = list(selection)
+        for hop in range(hops):
+            reached = []
+            for neuron in frontier:
+                for (neighbour, synapse) in self._adjacent(neuron):
+                    if (neighbour not in selection and followed(synapse)
+                    and (classes is None or any(c in classes for c in neighbour.classes))):
+                        selection.add(neighbour)
+                        reached.append(neighbour)
+            frontier = reached
+        synapses = []
+        for neuron in selection:
+            for (neighbour, synapse) in self._adjacent(neuron):
+                if synapse.source == neuron.id and neighbour in selection and followed(synapse):
+                    synapses.append(synapse)
+        root = self._groups.root()
+        for component in list(selection):
+            while component.group is not None and component.group is not root:
+                component = component.group
+                selection.add(component)
+        return Selection(selection, synapses)
+
+    def to_celldl(self, selection=None):
+        flat_map = [self._groups.to_celldl(2, selection)]
+        for s in (self._synapses if selection is None else selection.connections):
+            flat_map.append(s.to_celldl(2))
+        return celldl_document(flat_map, self.style(2))
+
+    def to_celldl_tiles(self, name):
+        # Each top-level group goes into its own tile, with a coarse overview
+        # of the top-level groups and neurons linking to the tiles. Synapses
+        # crossing tiles are kept in the tiles at both of their ends, with the
+        # remote end shown as a stub, and are collapsed onto the top-level
+        # components in the overview.
+        overview_file = '{}-tiles.celldl'.format(name)
+        top_level = self._groups.root().components
+        tile_files = {}
+        for c in top_level:
+            if isinstance(c, Group):
+                tile_files[c.id] = '{}-{}.celldl'.format(name, c.id)
+        components = {n.id: n for n in self._neurons.values()}
+        tile_synapses = {tile: [] for tile in tile_files}
+        overview_synapses = {}
+        links = []
         for s in self._synapses:
-            celldl.append(s.to_celldl(2))
-        celldl.append('{}</flat-map>'.format(INDENT*' '))
-        celldl.append('{}<style>'.format(INDENT*' '))
-        celldl.append(self.style(2))
-        celldl.append('{}</style>'.format(INDENT*' '))
-        celldl.append('</cell-diagram>')
-        return '\n'.join(celldl)
+            source_top = self._groups.top_level(components[s.source])
+            target_top = self._groups.top_level(components[s.target])
+            source_tile = source_top.id if source_top.id in tile_files else None
+            target_tile = target_top.id if target_top.id in tile_files else None
+            if source_tile is None and target_tile is None:
+                overview_synapses[(s.source, s.target, s.type)] = s
+                continue
+            for tile in set([source_tile, target_tile]):
+                if tile is not None:
+                    tile_synapses[tile].append(s)
+            if source_tile != target_tile:
+                links.append(dict(source=s.source, target=s.target,
+                                  source_tile=source_tile, target_tile=target_tile,
+                                  type=s.type))
+                key = (source_top.id, target_top.id, s.connection_class)
+                if key not in overview_synapses:
+                    overview_synapses[key] = Synapse(source_top.id, target_top.id, s.type)
+
+        files = {}
+        tiles = []
+        for c in top_level:
+            if c.id not in tile_files:
+                continue
+            stubs = {}
+            for s in tile_synapses[c.id]:
+                for end in [components[s.source], components[s.target]]:
+                    if self._groups.top_level(end) is not c:
+                        stubs[end.id] = end
+            flat_map = [c.to_celldl(2)]
+            for stub in stubs.values():
+                flat_map.append(stub.to_tile_reference(2,
+                    tile_files.get(self._groups.top_level(stub).id, overview_file), stub=True))
+            for s in tile_synapses[c.id]:
+                flat_map.append(s.to_celldl(2))
+            files[tile_files[c.id]] = celldl_document(flat_map,
+                '\n'.join([self.style(2), STUB_STYLE_RULES]))
+            tiles.append(dict(id=c.id, label=c.name, file=tile_files[c.id],
+                              connections=len(tile_synapses[c.id])))
+
+        flat_map = []
+        for c in top_level:
+            if c.id in tile_files:
+                flat_map.append(c.to_tile_reference(2, tile_files[c.id]))
+            else:
+                flat_map.append(c.to_celldl(2))
+        for s in overview_synapses.values():
+            flat_map.append(s.to_celldl(2))
+        files[overview_file] = celldl_document(flat_map, self.style(2))
+
+        files['{}-tiles.json'.format(name)] = json.dumps({
+            'overview': overview_file,
+            'tiles': tiles,
+            'links': links
+            }, sort_keys=True, indent=INDENT, separators=(',', ': '))
+        return files
+
+    def _supernode(self, component, depth):
+        # The component's group at ``depth`` in the group tree, or the
+        # component itself when it isn't that deep
+        root = self._groups.root()
+        ancestors = [component]
+        while ancestors[-1].group is not None and ancestors[-1].group is not root:
+            ancestors.append(ancestors[-1].group)
+        return ancestors[max(len(ancestors) - 1 - depth, 0)]
+
+    def _overview_components(self, depth):
+        # ``(component, depth)`` pairs for the components shown in an overview
+        components = []
+        pending = [(c, 0) for c in reversed(self._groups.root().components)]
+        while pending:
+            (component, level) = pending.pop()
+            components.append((component, level))
+            if level < depth and isinstance(component, Group):
+                pending.extend([(c, level+1) for c in reversed(component.components)])
+        return components
+
+    def to_overview(self, name, depth=0):
+        # Everything below ``depth`` in the group tree is collapsed into a
+        # supernode for its group at that depth, with synapses aggregated by
+        # their class, as only one connection of a class may join two components.
+        # Synapses within a supernode are counted on its node rather than being
+        # shown as loops. Collapsed groups link to the full diagram, ``<name>.celldl``.
+        detail = '{}.celldl'.format(name)
+        neurons = {n.id: n for n in self._neurons.values()}
+        synapses = {}
+        internal = {}
+        for s in self._synapses:
+            source = self._supernode(neurons[s.source], depth)
+            target = self._supernode(neurons[s.target], depth)
+            if source is target and isinstance(source, Group):
+                if source.id not in internal:
+                    internal[source.id] = OverviewSynapse(source.id, target.id, None)
+                internal[source.id].add(s)
+                continue
+            key = (source.id, target.id, s.connection_class)
+            if key not in synapses:
+                synapses[key] = OverviewSynapse(source.id, target.id, s.connection_class)
+            synapses[key].add(s)
+        flat_map = [c.to_overview_celldl(2, depth, detail) for c in self._groups.root().components]
+        for s in synapses.values():
+            flat_map.append(s.to_celldl(2))
+        nodes = []
+        for (c, level) in self._overview_components(depth):
+            node = c.to_json()
+            if level == depth and isinstance(c, Group) and c.components:
+                node['collapsed'] = sum(1 for _ in c.subtree()) - 1
+            if c.id in internal:
+                strength = internal[c.id].strength
+                node['internal'] = internal[c.id].count
+                node['internal_strength'] = round(strength, 6) if strength is not None else None
+            nodes.append(node)
+        return {
+            '{}-overview.celldl'.format(name): celldl_document(flat_map, self.style(2)),
+            '{}-overview.json'.format(name): json.dumps({
+                'depth': depth,
+                'detail': detail,
+                'nodes': nodes,
+                'links': [s.to_json() for s in synapses.values()]
+                }, sort_keys=True, indent=INDENT, separators=(',', ': '))
+            }
+
+    def to_csr(self):
+        # The synapses as a compressed sparse row adjacency matrix, with rows
+        # and columns in the order of ``neurons`` (a table of neuron id, name
+        # and group id). Synapse ``k`` goes from the neuron whose row range
+        # ``indptr[i]:indptr[i+1]`` contains ``k`` to neuron ``indices[k]``,
+        # with its type given by ``edge_types[edge_type[k]]`` and its strength
+        # by ``weight[k]`` (NaN when unknown).
+        if np is None:
+            raise ImportError('CSR export needs the numpy package')
+        neurons = sorted(self._neurons.values(), key=lambda n: int(n.id[1:]))
+        rows = {n.id: row for (row, n) in enumerate(neurons)}
+        edge_types = sorted(set(s.type or '' for s in self._synapses))
+        type_codes = {t: code for (code, t) in enumerate(edge_types)}
+        sources = np.array([rows[s.source] for s in self._synapses], dtype=np.int64)
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(len(neurons) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(neurons)), out=indptr[1:])
+        indices = np.array([rows[s.target] for s in self._synapses], dtype=np.int32)[order]
+        edge_type = np.array([type_codes[s.type or ''] for s in self._synapses], dtype=np.int16)[order]
+        weight = np.array([s.strength if s.strength is not None else np.nan
+                           for s in self._synapses], dtype=np.float64)[order]
+        root = self._groups.root()
+        table = [(n.id, n.name, n.group.id if n.group is not None and n.group is not root else '')
+                 for n in neurons]
+        width = max([len(v) for row in table for v in row] + [1])
+        return {
+            'indptr': indptr,
+            'indices': indices,
+            'edge_type': edge_type,
+            'weight': weight,
+            'edge_types': np.array(edge_types, dtype='U{}'.format(max([len(t) for t in edge_types] + [1]))),
+            'neurons': np.array(table, dtype=[('id', 'U{}'.format(width)),
+                                              ('name', 'U{}'.format(width)),
+                                              ('group', 'U{}'.format(width))])
+            }
+
+    def write_csr(self, directory):
+        # Arrays are saved uncompressed so they can be memory mapped by ``load_csr()``
+        os.makedirs(directory, exist_ok=True)
+        for (name, array) in self.to_csr().items():
+            np.save(os.path.join(directory, '{}.npy'.format(name)), array, allow_pickle=False)
+        return directory
 
     def style(self, level):
         styling = [DEFAULT_STYLE_RULES]
 ##        styling.append(self._groups.root().style(level))
         return '\n'.join(styling)
 
-    def to_json(self):
+    def to_json(self, selection=None):
         nodes = []
         links = []
         groups = []
         for n in self._neurons.values():
-            nodes.append(n.to_json())
-        for s in self._synapses:
+            if selection is None or n in selection:
+                nodes.append(n.to_json())
+        for s in (self._synapses if selection is None else selection.connections):
             links.append(s.to_json())
         return { 'nodes': nodes,
                  'links': links,
-                 'groups': self._groups.to_json()
+                 'groups': self._groups.to_json(selection)
                }
 
 # -----------------------------------------------------------------------------
 
+def load_csr(directory, mmap_mode='r'):
+    # Memory mapping means arrays are only read from disk as they are used
+    if np is None:
+        raise ImportError('CSR export needs the numpy package')
+    return {name: np.load(os.path.join(directory, '{}.npy'.format(name)),
+                          mmap_mode=mmap_mode, allow_pickle=False)
+            for name in CSR_ARRAYS}
+
+
+def load_network(filename):
+    with open(filename) as f:
+        reader = csv.DictReader(f, delimiter=',')
+        return NeuralNetwork(reader)
+
+
+def serialise(network, output_format, selection=None):
+    if output_format == 'json':
+        return json.dumps(network.to_json(selection), sort_keys=True,
+                          indent=INDENT, separators=(',', ': '))
+    elif output_format == 'celldl':
+        return network.to_celldl(selection)
+    elif output_format == 'neurons':
+        return network.neurons()
+    elif output_format == 'svg':
+        return svg_render.render_celldl(network.to_celldl(selection))
+    raise ValueError('Unknown output format: {}'.format(output_format))
+
+
+def serialise_all(network, output_formats, selection=None, workers=None):
+    # Parse once, write many: each requested format is serialised concurrently
+    # and SVG is rendered from the CellDL that is produced anyway, rather than
+    # converting a second time. Returns a dictionary of results keyed by format.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        if 'celldl' in output_formats or 'svg' in output_formats:
+            futures['celldl'] = executor.submit(network.to_celldl, selection)
+        for output_format in output_formats:
+            if output_format not in futures and output_format != 'svg':
+                futures[output_format] = executor.submit(serialise, network, output_format, selection)
+        if 'svg' in output_formats:
+            # Submitted after the CellDL so never waits on a task that hasn't started
+            futures['svg'] = executor.submit(lambda: svg_render.render_celldl(futures['celldl'].result()))
+        return {output_format: futures[output_format].result() for output_format in output_formats}
+
+
+def convert_many(filenames, output_format='celldl', workers=None):
+    # Every conversion has its own state, so networks can be converted in
+    # parallel threads. Results are in the same order as ``filenames``.
+    def convert(filename):
+        return serialise(load_network(filename), output_format)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(convert, filenames))
+
+# -----------------------------------------------------------------------------
+
 if __name__ == '__main__':
 
+    import argparse
     import sys
 
-    if len(sys.argv) < 3:
-        sys.exit('Usage: {} CSV_FILE [celldl | json]'.format(sys.argv[0]))
-
-    with open(sys.argv[1]) as f:
-        reader = csv.DictReader(f, delimiter=',')
-        network = NeuralNetwork(reader)
-
-    if sys.argv[2] in ['json', 'JSON']:
-        print(json.dumps(network.to_json(), sort_keys=True,
-                         indent=INDENT, separators=(',', ': ')))
-    elif sys.argv[2] in ['celldl', 'CELLDL']:
-        print(network.to_celldl())
-    elif sys.argv[2] == 'neurons':
-        print(network.neurons())
-    else:
-        sys.exit("Unknown output format")
+    def format_list(value):
+        formats = value.lower().split(',')
+        for output_format in formats:
+            if output_format not in OUTPUT_FORMATS + FILE_SET_FORMATS:
+                raise argparse.ArgumentTypeError('invalid format: {} (choose from {})'.format(
+                    output_format, ', '.join(OUTPUT_FORMATS + FILE_SET_FORMATS)))
+        return formats
+
+    parser = argparse.ArgumentParser(description='Convert a neural connectivity CSV file to a cell diagram.')
+    parser.add_argument('csv_file', metavar='CSV_FILE',
+                        help='the connectivity to convert')
+    parser.add_argument('format', metavar='FORMAT', type=format_list,
+                        help='output format ({}), or a comma separated list of formats '
+                             'to write to files in the output directory'.format(', '.join(OUTPUT_FORMATS + FILE_SET_FORMATS)))
+    parser.add_argument('--output-dir', metavar='DIRECTORY', default='.',
+                        help='where to write tiles and files (default: current directory)')
+    parser.add_argument('--neighbourhood', metavar='NAME', action='append',
+                        help='only output what is near the named population (may be repeated)')
+    parser.add_argument('--hops', metavar='K', type=int, default=1,
+                        help='size of the neighbourhood in synapses (default: 1)')
+    parser.add_argument('--class', metavar='CLASS', dest='classes', action='append',
+                        help='only extend the neighbourhood to neurons with this class')
+    parser.add_argument('--overview-depth', metavar='DEPTH', type=int, default=0,
+                        help='group depth below which an overview is collapsed (default: 0)')
+    parser.add_argument('--synaptic-type', metavar='TYPE', dest='types', action='append',
+                        help='only extend the neighbourhood along this type of synapse')
+    args = parser.parse_args()
+
+    network = load_network(args.csv_file)
+
+    selection = (network.neighbourhood(args.neighbourhood, args.hops, args.classes, args.types)
+                    if args.neighbourhood else None)
+    name = os.path.splitext(os.path.basename(args.csv_file))[0]
+    output_formats = [f for f in args.format if f not in FILE_SET_FORMATS]
+    if len(args.format) == 1 and output_formats:
+        print(serialise(network, output_formats[0], selection))
+    elif output_formats:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for output_format, contents in serialise_all(network, output_formats, selection).items():
+            with open(os.path.join(args.output_dir, name + FILE_EXTENSIONS[output_format]),
+                      'w', encoding='utf-8') as f:
+                f.write(contents)
+    files = {}
+    if 'tiles' in args.format:
+        files.update(network.to_celldl_tiles(name))
+    if 'overview' in args.format:
+        files.update(network.to_overview(name, args.overview_depth))
+    if 'csr' in args.format:
+        try:
+            network.write_csr(os.path.join(args.output_dir, '{}-csr'.format(name)))
+        except ImportError as error:
+            sys.exit(str(error))
+    if files:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for filename, contents in files.items():
+            with open(os.path.join(args.output_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(contents)
 
 # -----------------------------------------------------------------------------
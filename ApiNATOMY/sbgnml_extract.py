@@ -18,12 +18,17 @@
 #
 # -----------------------------------------------------------------------------
 
+from concurrent.futures import ThreadPoolExecutor
+import gzip
 import json
-import logging
 from lxml import etree
+import math
+import mmap
 import os
 import pathlib
 
+import svg_render
+
 # -----------------------------------------------------------------------------
 
 NAMESPACES = { 'bqbiol': 'http://biomodels.net/biology-qualifiers/',
@@ -35,6 +40,26 @@ NAMESPACES = { 'bqbiol': 'http://biomodels.net/biology-qualifiers/',
                'sio': 'http://semanticscience.org/resource/',
               }
 
+# Namespace qualified names used when reading annotations
+
+def clark_name(prefix, tag):
+    return '{{{}}}{}'.format(NAMESPACES[prefix], tag)
+
+BQBIOL_IS = clark_name('bqbiol', 'is')
+BQMODEL_IS_DERIVED_FROM = clark_name('bqmodel', 'isDerivedFrom')
+RDF_ABOUT = clark_name('rdf', 'about')
+RDF_BAG = clark_name('rdf', 'Bag')
+RDF_DESCRIPTION = clark_name('rdf', 'Description')
+RDF_LI = clark_name('rdf', 'li')
+RDF_RESOURCE = clark_name('rdf', 'resource')
+SBGN_ANNOTATION = clark_name('sbgn', 'annotation')
+SBGN_END = clark_name('sbgn', 'end')
+SBGN_GLYPH = clark_name('sbgn', 'glyph')
+SBGN_LABEL = clark_name('sbgn', 'label')
+SBGN_NEXT = clark_name('sbgn', 'next')
+SBGN_PORT = clark_name('sbgn', 'port')
+SBGN_START = clark_name('sbgn', 'start')
+
 # -----------------------------------------------------------------------------
 
 # Percentage range for automatically placing elements in a component
@@ -48,6 +73,25 @@ INDENT = 4
 
 # -----------------------------------------------------------------------------
 
+# Glyph classes that are converted by default
+
+CLASS_LIST = ['compartment', 'macromolecule']
+
+OUTPUT_FORMATS = ['celldl', 'json', 'rdf', 'svg']
+
+# Formats written as a set of files
+
+FILE_SET_FORMATS = ['overview', 'tiles']
+
+FILE_EXTENSIONS = {
+    'celldl': '.celldl',
+    'json': '.json',
+    'rdf': '.ttl',
+    'svg': '.svg',
+}
+
+# -----------------------------------------------------------------------------
+
 DEFAULT_SIZES = {
     'DIAGRAM': (1000, 1000),
     'compartment': (25, 25),
@@ -106,6 +150,15 @@ DEFAULT_STYLE_RULES = """
            *DEFAULT_SIZES['macromolecule'],
            *DEFAULT_SIZES['process'])
 
+# Stubs stand in for the remote end of a connection that crosses tiles
+
+STUB_STYLE_RULES = """
+        .stub {
+            opacity: 0.4;
+            size: 2v, 2v;
+        }
+"""
+
 # -----------------------------------------------------------------------------
 
 TURTLE_PREFIXES = ['@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .',
@@ -126,11 +179,98 @@ TYPE_TO_CLASS = { 'http://identifiers.org/GO:0060076': 'excitatory',
 
 # -----------------------------------------------------------------------------
 
+class ConversionError(Exception):
+    pass
+
+# -----------------------------------------------------------------------------
+
+# Issues are recorded as plain tuples and only formatted when reported, with
+# repeats of an issue counted rather than stored again.
+
+class Diagnostics(object):
+    ERROR = 'error'
+    WARNING = 'warning'
+
+    MESSAGES = {
+        'compartment-conflict': 'Glyph ({glyph}) has compartmentRef ({compartment}) but is enclosed by ({enclosing})',
+        'invalid-arc-end': 'Arc ({arc}) has invalid source ({source}) or target ({target})',
+        'invalid-arc-source': 'Invalid class of arc source ({source})',
+        'invalid-process-source': 'Process ({process}) source ({source}) has invalid class',
+        'invalid-process-target': 'Process ({process}) target ({target}) has invalid class',
+        'process-without-sources': 'Process ({process}) has no sources and targets {targets}',
+        'process-without-targets': 'Process ({process}) has no targets',
+        'unconnected-process': 'Process ({process}) is not connected',
+    }
+
+    def __init__(self, max_errors=None):
+        self._max_errors = max_errors
+        self._issues = {}
+        self._errors = 0
+        self._warnings = 0
+
+    @property
+    def errors(self):
+        return self._errors
+
+    @property
+    def warnings(self):
+        return self._warnings
+
+    def error(self, code, **details):
+        self._record(self.ERROR, code, details)
+
+    def warning(self, code, **details):
+        self._record(self.WARNING, code, details)
+
+    def _record(self, severity, code, details):
+        key = (severity, code, tuple(sorted(details.items())))
+        count = self._issues.get(key)
+        if count is not None:
+            self._issues[key] = count + 1
+            return
+        self._issues[key] = 1
+        if severity == self.ERROR:
+            self._errors += 1
+            if self._max_errors is not None and self._errors > self._max_errors:
+                raise ConversionError('More than {} errors: {}'.format(self._max_errors,
+                                      self.message(code, details)))
+        else:
+            self._warnings += 1
+
+    @classmethod
+    def message(cls, code, details):
+        return cls.MESSAGES[code].format(**details)
+
+    def issues(self):
+        for (severity, code, details), count in self._issues.items():
+            yield (severity, code, dict(details), count)
+
+    def summary(self):
+        counts = {}
+        for (severity, code, details), count in self._issues.items():
+            counts[(severity, code)] = counts.get((severity, code), 0) + 1
+        summary = ['{} errors, {} warnings'.format(self._errors, self._warnings)]
+        for (severity, code), count in sorted(counts.items()):
+            summary.append('    {:8} {:28} {}'.format(severity, code, count))
+        return '\n'.join(summary)
+
+    def to_json(self):
+        return { 'errors': self._errors,
+                 'warnings': self._warnings,
+                 'issues': [dict(severity=severity, code=code, count=count,
+                                 message=self.message(code, details), details=details)
+                                for (severity, code, details, count) in self.issues()]
+               }
+
+# -----------------------------------------------------------------------------
+
+# Ids are unique within a single conversion
+
 class Id(object):
-    _ids = []
+    def __init__(self):
+        self._ids = set()
 
-    @staticmethod
-    def new(name, guid):
+    def new(self, name, guid):
         if name:
             clean_name = (name.replace(' (+)', '_plus')
                               .replace('Pump-', 'Pump-minus')
@@ -147,23 +287,22 @@ class Id(object):
             id = 'ID'
         n = 1
         unique = id
-        while unique in Id._ids:
+        while unique in self._ids:
             unique = '{}-{}'.format(id, n)
             n += 1
-        Id._ids.append(unique)
+        self._ids.add(unique)
         return unique
 
 # -----------------------------------------------------------------------------
 
 def annotations(description_xml, property):
     values = []
-    properties = description_xml.find(property, NAMESPACES)
+    properties = description_xml.find(property)
     if properties is not None:
-        bag = properties.find('rdf:Bag', NAMESPACES)
+        bag = properties.find(RDF_BAG)
         if bag is not None:
-            for item in bag.findall('rdf:li', NAMESPACES):
-                resource = item.get('{{{}}}resource'.format(NAMESPACES['rdf']))
-                values.append(resource)
+            for item in bag.findall(RDF_LI):
+                values.append(item.get(RDF_RESOURCE))
     return values
 
 
@@ -171,6 +310,18 @@ def celldl_class_attribute(_type):
     cls = TYPE_TO_CLASS.get(_type)
     return ' class="{}"'.format(cls) if cls is not None else ''
 
+
+def celldl_document(flat_map, style):
+    celldl = ['<cell-diagram>']
+    celldl.append('{}<flat-map>'.format(INDENT*' '))
+    celldl.extend(flat_map)
+    celldl.append('{}</flat-map>'.format(INDENT*' '))
+    celldl.append('{}<style>'.format(INDENT*' '))
+    celldl.append(style)
+    celldl.append('{}</style>'.format(INDENT*' '))
+    celldl.append('</cell-diagram>')
+    return '\n'.join(celldl)
+
 # -----------------------------------------------------------------------------
 
 class Scaler(object):
@@ -227,6 +378,67 @@ class BBox(object):
         return ((self._x - self._width/2.0, self._x + self._width/2.0),
                 (self._y - self._height/2.0, self._y + self._height/2.0))
 
+    @property
+    def extent(self):
+        return (self._x - self._width/2.0, self._y - self._height/2.0,
+                self._x + self._width/2.0, self._y + self._height/2.0)
+
+    @property
+    def area(self):
+        return self._width*self._height
+
+# -----------------------------------------------------------------------------
+
+def extent_contains(outer, inner):
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+        and outer[2] >= inner[2] and outer[3] >= inner[3])
+
+# -----------------------------------------------------------------------------
+
+# A static R-tree over ``(extent, value)`` items, bulk loaded using
+# Sort-Tile-Recursive packing so that building is O(n log n).
+
+class SpatialIndex(object):
+    def __init__(self, items, node_size=8):
+        self._node_size = node_size
+        # Nodes are (extent, children, value) with ``children`` None for leaves
+        level = [(extent, None, value) for (extent, value) in items]
+        while len(level) > node_size:
+            level = self._pack(level)
+        self._root = (self._enclosing(level), level, None) if level else None
+
+    @staticmethod
+    def _enclosing(nodes):
+        return (min(n[0][0] for n in nodes), min(n[0][1] for n in nodes),
+                max(n[0][2] for n in nodes), max(n[0][3] for n in nodes))
+
+    def _pack(self, nodes):
+        size = self._node_size
+        slice_count = int(math.ceil(math.sqrt(math.ceil(len(nodes)/size))))
+        slice_size = slice_count*size
+        nodes = sorted(nodes, key=lambda n: n[0][0] + n[0][2])
+        packed = []
+        for s in range(0, len(nodes), slice_size):
+            vertical_slice = sorted(nodes[s:s+slice_size], key=lambda n: n[0][1] + n[0][3])
+            for n in range(0, len(vertical_slice), size):
+                children = vertical_slice[n:n+size]
+                packed.append((self._enclosing(children), children, None))
+        return packed
+
+    def containing(self, extent):
+        # Only nodes whose extent contains the query can hold items that do
+        result = []
+        if self._root is not None and extent_contains(self._root[0], extent):
+            stack = [self._root]
+            while stack:
+                for node in stack.pop()[1]:
+                    if extent_contains(node[0], extent):
+                        if node[1] is None:
+                            result.append(node[2])
+                        else:
+                            stack.append(node)
+        return result
+
 # -----------------------------------------------------------------------------
 
 class Group(object):
@@ -237,17 +449,151 @@ class Group(object):
 
 # -----------------------------------------------------------------------------
 
+# WebCola layout constraints are limited to this many per node, so that the
+# size of JSON output stays proportional to the number of nodes
+
+CONSTRAINT_DENSITY = 1.0
+
+# Node centres closer than this (in SBGN coordinates) are considered aligned,
+# so alignment is found from glyphs' original bounding boxes
+
+ALIGNMENT_TOLERANCE = 1.0
+
+# -----------------------------------------------------------------------------
+
+# What is built up while converting to JSON, kept out of the SBGN_ML object
+# so that conversions don't share state
+
+class JsonContext(object):
+    def __init__(self):
+        self.nodes = []
+        self.glyphs = []
+        self.indices = {}
+        self.groups = {}
+
+# -----------------------------------------------------------------------------
+
+# Derives WebCola constraints from the original SBGN layout, so that the
+# client's layout starts close to the map's arrangement and converges quickly.
+# Constraints are only between nodes in the same group, in order of usefulness:
+#
+#   * alignment of nodes whose centres line up;
+#   * separation of linked nodes, keeping the link's dominant direction;
+#   * relative order of neighbouring nodes along each axis.
+
+class LayoutConstraints(object):
+    AXES = ['x', 'y']
+
+    def __init__(self, glyphs, links, density=CONSTRAINT_DENSITY):
+        self._glyphs = glyphs
+        self._links = links
+        self._limit = int(density*len(glyphs))
+        self._siblings = {}
+        for (index, glyph) in enumerate(glyphs):
+            self._siblings.setdefault(glyph.parent, []).append(index)
+
+    def _alignments(self):
+        for axis in range(2):
+            for siblings in self._siblings.values():
+                ordered = sorted(siblings, key=lambda n: self._glyphs[n].bbox.position[axis])
+                aligned = []
+                for n in ordered:
+                    if aligned and (self._glyphs[n].bbox.position[axis]
+                                  - self._glyphs[aligned[0]].bbox.position[axis]) > ALIGNMENT_TOLERANCE:
+                        if len(aligned) > 1:
+                            yield dict(type='alignment', axis=self.AXES[axis],
+                                       offsets=[dict(node=a, offset=0) for a in aligned])
+                        aligned = []
+                    aligned.append(n)
+                if len(aligned) > 1:
+                    yield dict(type='alignment', axis=self.AXES[axis],
+                               offsets=[dict(node=a, offset=0) for a in aligned])
+
+    def _separation(self, axis, left, right):
+        # Neighbours along an axis stay far enough apart not to overlap
+        gap = (self._glyphs[left].size[axis] + self._glyphs[right].size[axis])/2.0
+        return dict(axis=self.AXES[axis], left=left, right=right, gap=gap)
+
+    def _separations(self):
+        for (source, target) in self._links:
+            if (source is None or target is None or source == target
+             or self._glyphs[source].parent is not self._glyphs[target].parent):
+                continue
+            (x0, y0) = self._glyphs[source].position
+            (x1, y1) = self._glyphs[target].position
+            axis = 0 if abs(x1 - x0) >= abs(y1 - y0) else 1
+            if (x0, y0)[axis] <= (x1, y1)[axis]:
+                yield self._separation(axis, source, target)
+            else:
+                yield self._separation(axis, target, source)
+
+    def _orders(self):
+        for axis in range(2):
+            for siblings in self._siblings.values():
+                ordered = sorted(siblings, key=lambda n: self._glyphs[n].position[axis])
+                for (left, right) in zip(ordered, ordered[1:]):
+                    if self._glyphs[left].position[axis] < self._glyphs[right].position[axis]:
+                        yield dict(axis=self.AXES[axis], left=left, right=right, gap=0)
+
+    def constraints(self):
+        constraints = []
+        for generator in [self._alignments, self._separations, self._orders]:
+            for constraint in generator():
+                if len(constraints) >= self._limit:
+                    return constraints
+                constraints.append(constraint)
+        return constraints
+
+# -----------------------------------------------------------------------------
+
+# ``source`` and ``target`` are the guids of glyphs, with ports already
+# resolved to their glyph. The arc's route (its start, next and end points)
+# is kept as a flat tuple of coordinates and its glyphs as ``(guid, class,
+# label)`` tuples.
+
 class Arc(object):
-    def __init__(self, guid, cls, source, target):
+    def __init__(self, guid, cls, source, target, route=(), glyphs=()):
         self._guid = guid
         self._classes = [cls] if cls else []
-        self._source = source.rsplit('.')[0]  ## Port number...
-        self._target = target.rsplit('.')[0]
+        self._source = source
+        self._target = target
+        self._route = tuple(route)
+        self._glyphs = tuple(glyphs)
+
+    @classmethod
+    def from_xml(cls, arc_xml, resolve):
+        route = []
+        glyphs = []
+        for element in arc_xml:
+            if element.tag in [SBGN_START, SBGN_NEXT, SBGN_END]:
+                route.extend([float(element.get('x')), float(element.get('y'))])
+            elif element.tag == SBGN_GLYPH:
+                label = element.find(SBGN_LABEL)
+                glyphs.append((element.get('id'), element.get('class'),
+                               label.get('text', '') if label is not None else ''))
+        return cls(arc_xml.get('id'), arc_xml.get('class'),
+                   resolve(arc_xml.get('source')), resolve(arc_xml.get('target')),
+                   route, glyphs)
 
     @property
     def guid(self):
         return self._guid
 
+    @property
+    def route(self):
+        return list(zip(self._route[0::2], self._route[1::2]))
+
+    @property
+    def glyphs(self):
+        return self._glyphs
+
+    @property
+    def cardinality(self):
+        for (guid, cls, label) in self._glyphs:
+            if cls == 'cardinality':
+                return label
+        return None
+
     @property
     def primary_class(self):
         return self._classes[0]
@@ -268,20 +614,21 @@ class Arc(object):
 # -----------------------------------------------------------------------------
 
 class Glyph(object):
-    def __init__(self, guid, cls, label, bbox, compartment):
+    def __init__(self, guid, cls, label, bbox, compartment, ids, xml=None):
         self._guid = guid
         self._classes = [cls] if cls else []
         self._label = label
-        self._id = Id.new(label, guid)
+        self._id = ids.new(label, guid)
         self._bbox = bbox
         self._position = None
         self._size = None
         self._compartment = compartment
         self._parent = None
         self._children = []
-        self._index = None
         self._sources = []
         self._targets = []
+        # Annotations are only read from the glyph's XML when first needed
+        self._xml = xml
         self._derived_from = []
         self._type = None
 
@@ -289,6 +636,10 @@ class Glyph(object):
     def id(self):
         return self._id
 
+    @property
+    def guid(self):
+        return self._guid
+
     @property
     def primary_class(self):
         return self._classes[0]
@@ -301,10 +652,6 @@ class Glyph(object):
     def label(self):
         return self._label
 
-    @property
-    def index(self):
-        return self._index
-
     @property
     def children(self):
         return self._children
@@ -317,6 +664,9 @@ class Glyph(object):
     def compartment(self):
         return self._compartment
 
+    def set_compartment(self, compartment):
+        self._compartment = compartment
+
     @property
     def bbox(self):
         return self._bbox
@@ -339,8 +689,14 @@ class Glyph(object):
 
     @property
     def type(self):
+        self._get_annotations()
         return self._type
 
+    @property
+    def derived_from(self):
+        self._get_annotations()
+        return self._derived_from
+
     def is_a(self, cls):
         primary_class = self.primary_class
         return (primary_class in cls) if isinstance(cls, list) else (primary_class == cls)
@@ -351,9 +707,6 @@ class Glyph(object):
     def add_target(self, target):
         self._targets.append(target)
 
-    def set_index(self, index):
-        self._index = index
-
     def set_position(self, position):
         self._position = position
 
@@ -366,53 +719,90 @@ class Glyph(object):
     def add_child(self, child):
         self._children.append(child)
 
-    def add_warning(self, message):
-        logging.warning(message)
-        self._classes.append('warn')
-
-    def get_annotations(self, glyph_xml):
-        for annotation in glyph_xml.iter('{{{}}}annotation'.format(NAMESPACES['sbgn'])):
-            for description in annotation.iter('{{{}}}Description'.format(NAMESPACES['rdf'])):
-                guid = description.get('{{{}}}about'.format(NAMESPACES['rdf']))[1:]
+    def add_warning(self):
+        if 'warn' not in self._classes:
+            self._classes.append('warn')
+
+    def _get_annotations(self):
+        # The XML is only cleared once the annotations have been set, as
+        # other threads may be reading them at the same time
+        glyph_xml = self._xml
+        if glyph_xml is None:
+            return
+        derived_from = []
+        _type = None
+        for annotation in glyph_xml.iter(SBGN_ANNOTATION):
+            for description in annotation.iter(RDF_DESCRIPTION):
+                guid = description.get(RDF_ABOUT)[1:]
                 if guid != self._guid:
                     raise ValueError("Annotation is not about us ({})".format(self._guid))
-                self._derived_from = annotations(description, 'bqmodel:isDerivedFrom')
-                types = annotations(description, 'bqbiol:is')
+                derived_from = annotations(description, BQMODEL_IS_DERIVED_FROM)
+                types = annotations(description, BQBIOL_IS)
                 if types:
-                    self._type = types[0]
+                    _type = types[0]
+        self._derived_from = derived_from
+        self._type = _type
+        self._xml = None
 
-    def _attributes(self):
+    def subtree(self):
+        yield self
+        for c in self._children:
+            yield from c.subtree()
+
+    def _attributes(self, tile=None, stub=False):
         attribs = ['id="{}"'.format(self._id)]
         if self._classes:
             classes = self._classes.copy()
             if classes[0] == 'compartment' and self._parent is None:
                 classes.append('outermost')
+            if stub:
+                classes.append('stub')
             attribs.append('class="{}"'.format(' '.join(classes)))
         if self._label != '':
             attribs.append('label="{}"'.format(self._label))
         else:
             attribs.append('label="_"')
+        if tile is not None:
+            attribs.append('tile="{}"'.format(tile))
         return ' '.join(attribs)
 
-    def to_celldl(self, level=0, class_filter=None):
+    def to_celldl(self, level=0, class_filter=None, selection=None):
         indent = INDENT*level*' '
         if len(self._children) == 0:
             return '{}<component {}/>'.format(indent, self._attributes())
         else:
             celldl = ['{}<component {}>'.format(indent, self._attributes())]
             for c in self._children:
-                if class_filter is None or c.primary_class in class_filter:
-                    celldl.append(c.to_celldl(level+1, class_filter))
+                if ((class_filter is None or c.primary_class in class_filter)
+                and (selection is None or c in selection)):
+                    celldl.append(c.to_celldl(level+1, class_filter, selection))
             celldl.append('{}</component>'.format(indent))
             return '\n'.join(celldl)
 
+    def to_tile_reference(self, level, tile, stub=False):
+        indent = INDENT*level*' '
+        return '{}<component {}/>'.format(indent, self._attributes(tile, stub))
+
+    def to_overview_celldl(self, level, depth, class_filter=None, detail=None):
+        # Below ``depth`` our subtree is collapsed into us, linking to the
+        # detailed diagram
+        if len(self._children) == 0 or depth <= 0:
+            return self.to_tile_reference(level, detail if self._children else None)
+        indent = INDENT*level*' '
+        celldl = ['{}<component {}>'.format(indent, self._attributes())]
+        for c in self._children:
+            if class_filter is None or c.primary_class in class_filter:
+                celldl.append(c.to_overview_celldl(level+1, depth-1, class_filter, detail))
+        celldl.append('{}</component>'.format(indent))
+        return '\n'.join(celldl)
+
     def to_turtle(self):
         turtle = [self.uri]
         turtle.append('    a fm:Component;')
         if self._label:
             turtle.append('    rdfs:label "{}";'.format(self._label))
-        if self._derived_from:
-            derived_from = ['<{}>'.format(d) for d in self._derived_from]
+        if self.derived_from:
+            derived_from = ['<{}>'.format(d) for d in self.derived_from]
             turtle.append('    bqmodel:isDerivedFrom\n        {};'.format(',\n        '.join(derived_from)))
         if self._children:
             # ro:RO_0001019
@@ -421,11 +811,12 @@ class Glyph(object):
             turtle.append('    fm:connected_to\n        {};'.format(',\n        '.join([t.uri for t in self._targets])))
         return '\n'.join(turtle)
 
-    def style(self, level=0):
+    def style(self, level=0, position=None):
         indent = INDENT*level*' '
         indent1 = (INDENT+1)*level*' '
         style = ['{}#{} {{'.format(indent, self._id)]
-        style.append('{} position: {:.2f}%, {:.2f}%;'.format(indent1, *self.position))
+        style.append('{} position: {:.2f}%, {:.2f}%;'.format(indent1,
+                     *(position if position is not None else self.position)))
         if self.is_a('compartment'):
             style.append('{} size: {:.2f}%, {:.2f}%;'.format(indent1, *self.size))
         style.append('{}}}'.format(indent))
@@ -439,6 +830,18 @@ class Connection(object):
         self._target = target
         self._type = _type
 
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def type(self):
+        return self._type
+
     def to_celldl(self, level=0):
         indent = INDENT*level*' '
         return '{}<connection from="{}" to="{}"{}/>'.format(indent,
@@ -446,49 +849,137 @@ class Connection(object):
 
 # -----------------------------------------------------------------------------
 
+# Stands for all of the connections of a class between what two supernodes
+# of an overview contain
+
+class OverviewConnection(Connection):
+    def __init__(self, source, target, _type):
+        super().__init__(source, target, _type)
+        self._count = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    def add(self, connection):
+        self._count += 1
+
+    def to_celldl(self, level=0):
+        indent = INDENT*level*' '
+        return '{}<connection from="{}" to="{}"{} count="{}"/>'.format(indent,
+            self._source.id, self._target.id, celldl_class_attribute(self._type), self._count)
+
+    def to_json(self):
+        return {'source': self._source.id,
+                'target': self._target.id,
+                'type': self._type,
+                'count': self._count
+               }
+
+# -----------------------------------------------------------------------------
+
+class Selection(object):
+    def __init__(self, glyphs, connections):
+        self._glyphs = glyphs
+        self._connections = connections
+
+    def __contains__(self, glyph):
+        return glyph in self._glyphs
+
+    def __iter__(self):
+        return iter(self._glyphs)
+
+    def __len__(self):
+        return len(self._glyphs)
+
+    @property
+    def connections(self):
+        return self._connections
+
+# -----------------------------------------------------------------------------
+
 class SBGN_ML(object):
 
     @staticmethod
     def NS(tag):
-        return '{{{}}}{}'.format(NAMESPACES['sbgn'], tag)
+        return clark_name('sbgn', tag)
 
-    def __init__(self, text, source_uri=None):
+    def __init__(self, text, source_uri=None, infer_compartments=False, diagnostics=None):
         self._source_uri = source_uri
-        self._xml = etree.fromstring(text)
+        self._diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        self._xml = text if etree.iselement(text) else etree.fromstring(text)
         assert self._xml.tag == self.NS('sbgn'), 'Not a valid SBGN document'
         self._glyphs = {}
-        self._root_glyphs = []
+        # Arcs may end at a glyph's port or at one of its nested glyphs
+        self._ports = {}
+        ids = Id()
         for glyph in self._xml.findall('sbgn:map/sbgn:glyph', NAMESPACES):
             guid = glyph.get('id')
             if guid:
                 label = glyph.find('sbgn:label', NAMESPACES)
                 bbox = glyph.find('sbgn:bbox', NAMESPACES)
-
-                #ports = glyph.findall('sgbn:port', NAMESPACES)
-                #<port id="nwtN_b458504e-cb3e-4699-8689-c4c427fe48d2.1" />
-
+                for port in glyph.iter(SBGN_PORT, SBGN_GLYPH):
+                    if port is not glyph and port.get('id'):
+                        self._ports[port.get('id')] = guid
                 g = Glyph(guid, glyph.get('class'),
                           label.get('text', '') if label is not None else '',
                           BBox(float(bbox.get('x')), float(bbox.get('y')),
                                float(bbox.get('w')), float(bbox.get('h'))) if bbox is not None else None,
-                          glyph.get('compartmentRef', None))
+                          glyph.get('compartmentRef', None), ids, glyph)
                 self._glyphs[guid] = g
-                if g.compartment is None:
-                    self._root_glyphs.append(g)
-                g.get_annotations(glyph)
+        if infer_compartments:
+            self._infer_compartments()
         for g in self._glyphs.values():
             if g.compartment:
                 parent = self._glyphs[g.compartment]
                 g.set_parent(parent)
                 parent.add_child(g)
+        self._root_glyphs = [g for g in self._glyphs.values() if g.compartment is None]
         self._geometry = self.assign_geometry(self._root_glyphs)
-        self._arcs = []
-        for arc in self._xml.findall('sbgn:map/sbgn:arc', NAMESPACES):
-            label = glyph.find('sbgn:label', NAMESPACES)
-            bbox = glyph.find('sbgn:bbox', NAMESPACES)
-            self._arcs.append(Arc(arc.get('id'), arc.get('class'),
-                                  arc.get('source'), arc.get('target')))
-            self._connections = []
+        self._arcs = [Arc.from_xml(arc, self._resolve_reference)
+                        for arc in self._xml.findall('sbgn:map/sbgn:arc', NAMESPACES)]
+        self._connections = []
+        self._adjacency = None
+        self._glyphs_by_name = None
+
+    def _resolve_reference(self, reference):
+        # Unknown references are left as they are, to be reported by ``assign_links()``
+        return reference if reference in self._glyphs else self._ports.get(reference, reference)
+
+    def _infer_compartments(self):
+        # Geometric nesting gives each glyph's tightest enclosing compartment;
+        # this is used when ``compartmentRef`` is missing and otherwise checked
+        # against it.
+        compartments = [g for g in self.compartments if g.bbox is not None]
+        index = SpatialIndex([(c.bbox.extent, c) for c in compartments])
+        inferred_compartments = {}
+        for g in self._glyphs.values():
+            if g.bbox is None:
+                continue
+            area = g.bbox.area
+            inferred = None
+            for c in index.containing(g.bbox.extent):
+                if c.bbox.area > area and (inferred is None or c.bbox.area < inferred.bbox.area):
+                    inferred = c
+            inferred_compartments[g.guid] = inferred.guid if inferred is not None else None
+        for g in self._glyphs.values():
+            if g.guid not in inferred_compartments:
+                continue
+            inferred = inferred_compartments[g.guid]
+            if g.compartment is None:
+                if inferred is not None and not self._is_ancestor(g.guid, inferred):
+                    g.set_compartment(inferred)
+            elif g.compartment != inferred:
+                self._diagnostics.warning('compartment-conflict', glyph=g.guid,
+                                          compartment=g.compartment, enclosing=inferred)
+
+    def _is_ancestor(self, guid, compartment):
+        while compartment is not None:
+            if compartment == guid:
+                return True
+            glyph = self._glyphs.get(compartment)
+            compartment = glyph.compartment if glyph is not None else None
+        return False
 
     @staticmethod
     def assign_geometry(children):
@@ -501,6 +992,18 @@ class SBGN_ML(object):
             SBGN_ML.assign_geometry(c.children)
         return scaler
 
+    @property
+    def diagnostics(self):
+        return self._diagnostics
+
+    @property
+    def glyphs(self):
+        return list(self._glyphs.values())
+
+    @property
+    def connections(self):
+        return self._connections
+
     def glyphs_of_class(self, cls):
         return [g for g in self._glyphs.values() if g.is_a(cls)]
 
@@ -517,6 +1020,7 @@ class SBGN_ML(object):
         return self.glyphs_of_class('process')
 
     def assign_links(self):
+        self._adjacency = None
         for arc in self._arcs:
             source = self._glyphs.get(arc.source)
             target = self._glyphs.get(arc.target)
@@ -525,100 +1029,325 @@ class SBGN_ML(object):
                     if target.is_a(['compartment', 'macromolecule']):
                         source.add_target(target)
                     else:
-                        logging.error("Process ({}) target ({}) has invalid class".format(source.id, target.id))
+                        self._diagnostics.error('invalid-process-target', process=source.id, target=target.id)
                 elif source.is_a(['compartment', 'macromolecule']):
                     if target.is_a('process'):
                         target.add_source(source)
                     else:
-                        logging.error("Process ({}) source ({}) has invalid class".format(target.id, source.id))
+                        self._diagnostics.error('invalid-process-source', process=target.id, source=source.id)
                 else:
-                    logging.error("Invalid class of arc source ({})".format(source.id))
+                    self._diagnostics.error('invalid-arc-source', source=source.id)
             else:
-                logging.error("Arc ({}) has invalid source ({}) or target ({})".format(arc.id, source.id, target.id))
+                # Report the SBGN references as either end may not exist
+                self._diagnostics.error('invalid-arc-end', arc=arc.guid, source=arc.source, target=arc.target)
 
         for process in self.processes:
             if len(process.sources) == 0 and len(process.targets) == 0:
-                process.add_warning("Process ({}) is not connected".format(process.id))
+                self._diagnostics.warning('unconnected-process', process=process.id)
+                process.add_warning()
             elif len(process.sources) == 0:
                 if len(process.targets) == 2:
                     self._connections.append(Connection(process.targets[0], process.targets[1], process.type))
                     self._connections.append(Connection(process.targets[1], process.targets[0], process.type))
                 else:
-                    process.add_warning("Process ({}) has no sources and targets {}".format(process.id,
-                                                                                           [t.id for t in process.targets]))
+                    self._diagnostics.warning('process-without-sources', process=process.id,
+                                              targets=tuple(t.id for t in process.targets))
+                    process.add_warning()
             elif len(process.targets) == 0:
-                process.add_warning("Process ({}) has no targets".format(process.id))
+                self._diagnostics.warning('process-without-targets', process=process.id)
+                process.add_warning()
             else:
                 # All sources connect to all targets
                 for source in process.sources:
                     for target in process.targets:
                         self._connections.append(Connection(source, target, process.type))
 
-    def to_celldl(self, class_filter=None):
-        celldl = ['<cell-diagram>']
-
-        celldl.append('{}<flat-map>'.format(INDENT*' '))
+    def _glyphs_named(self, name):
+        # Indices are only published once complete as other threads may be reading
+        glyphs_by_name = self._glyphs_by_name
+        if glyphs_by_name is None:
+            glyphs_by_name = {}
+            for g in self._glyphs.values():
+                for key in set([g.guid, g.id, g.label]):
+                    if key:
+                        glyphs_by_name.setdefault(key, []).append(g)
+            self._glyphs_by_name = glyphs_by_name
+        return glyphs_by_name.get(name, [])
+
+    def _adjacent(self, glyph):
+        adjacency = self._adjacency
+        if adjacency is None:
+            adjacency = {}
+            for c in self._connections:
+                adjacency.setdefault(c.source, []).append((c.target, c))
+                adjacency.setdefault(c.target, []).append((c.source, c))
+            self._adjacency = adjacency
+        return adjacency.get(glyph, [])
+
+    def neighbourhood(self, names, hops=1, classes=None, types=None):
+        # The glyphs within ``hops`` connections of the named glyphs (matched
+        # by SBGN id, CellDL id or label), along with their compartments.
+        # ``classes`` limits the glyphs reached and ``types`` the connections
+        # followed, given as either process types or CellDL classes.
+        def followed(connection):
+            return (types is None or connection.type in types
+                 or TYPE_TO_CLASS.get(connection.type) in types)
+
+        # Glyphs are kept in the order they are reached
+        selection = {}
+        for name in names:
+            selection.update((g, None) for g in self._glyphs_named(name))
+        frontier = list(selection)
+        for hop in range(hops):
+            reached = []
+            for glyph in frontier:
+                for (neighbour, connection) in self._adjacent(glyph):
+                    if (neighbour not in selection and followed(connection)
+                    and (classes is None or neighbour.primary_class in classes)):
+                        selection[neighbour] = None
+                        reached.append(neighbour)
+            frontier = reached
+        connections = []
+        for glyph in selection:
+            for (neighbour, connection) in self._adjacent(glyph):
+                if connection.source is glyph and neighbour in selection and followed(connection):
+                    connections.append(connection)
+        for glyph in list(selection):
+            while glyph.parent is not None and glyph.parent not in selection:
+                glyph = glyph.parent
+                selection[glyph] = None
+        return Selection(selection, connections)
+
+    def to_celldl(self, class_filter=None, selection=None):
+        flat_map = []
         for g in self._root_glyphs:
-            if class_filter is None or g.primary_class in class_filter:
-                celldl.append(g.to_celldl(2, class_filter))
-        for c in self._connections:
-            celldl.append(c.to_celldl(2))
+            if ((class_filter is None or g.primary_class in class_filter)
+            and (selection is None or g in selection)):
+                flat_map.append(g.to_celldl(2, class_filter, selection))
+        for c in (self._connections if selection is None else selection.connections):
+            flat_map.append(c.to_celldl(2))
         '''
         for a in self._arcs:               # Only between macromolecules...
-            celldl.append(a.to_celldl(2))
+            flat_map.append(a.to_celldl(2))
         '''
+        return celldl_document(flat_map, self.style(2, selection))
 
-        celldl.append('{}</flat-map>'.format(INDENT*' '))
-
-        celldl.append('{}<style>'.format(INDENT*' '))
-        celldl.append(self.style(2))
-        celldl.append('{}</style>'.format(INDENT*' '))
-
-        celldl.append('</cell-diagram>')
-        return '\n'.join(celldl)
+    @staticmethod
+    def _top_level(glyph):
+        while glyph.parent is not None:
+            glyph = glyph.parent
+        return glyph
 
-    def _json_build(self, glyph, class_filter=None):
+    @staticmethod
+    def _supernode(glyph, depth):
+        # The glyph's ancestor at ``depth`` in the compartment tree, or the
+        # glyph itself when it isn't that deep
+        ancestors = [glyph]
+        while ancestors[-1].parent is not None:
+            ancestors.append(ancestors[-1].parent)
+        return ancestors[max(len(ancestors) - 1 - depth, 0)]
+
+    def _overview_glyphs(self, depth, class_filter=None):
+        # ``(glyph, depth)`` pairs for the glyphs shown in an overview
+        glyphs = []
+        pending = [(g, 0) for g in reversed(self._root_glyphs)]
+        while pending:
+            (glyph, level) = pending.pop()
+            if class_filter is None or glyph.primary_class in class_filter:
+                glyphs.append((glyph, level))
+                if level < depth:
+                    pending.extend([(c, level+1) for c in reversed(glyph.children)])
+        return glyphs
+
+    def _overview_connections(self, depth):
+        # Connections are aggregated by their CellDL class, as only one
+        # connection of a class may join two components, and those within a
+        # supernode are counted separately. Returns the aggregated connections
+        # and the number within each supernode, by glyph.
+        connections = {}
+        internal = {}
+        for c in self._connections:
+            source = self._supernode(c.source, depth)
+            target = self._supernode(c.target, depth)
+            if source is target and source is not c.source:
+                internal[source] = internal.get(source, 0) + 1
+                continue
+            cls = TYPE_TO_CLASS.get(c.type)
+            key = (source.id, target.id, cls)
+            if key not in connections:
+                connections[key] = OverviewConnection(source, target, c.type if cls is not None else None)
+            connections[key].add(c)
+        return (list(connections.values()), internal)
+
+    def to_overview(self, name, depth=0, class_filter=None):
+        # Everything below ``depth`` in the compartment tree is collapsed into
+        # a supernode for its compartment at that depth, with connections
+        # aggregated by class. Connections within a supernode are counted on
+        # its node rather than being shown as loops. Collapsed compartments link
+        # to the full diagram, ``<name>.celldl``.
+        detail = '{}.celldl'.format(name)
+        glyphs = self._overview_glyphs(depth, class_filter)
+        (connections, internal) = self._overview_connections(depth)
+        flat_map = []
+        for g in self._root_glyphs:
+            if class_filter is None or g.primary_class in class_filter:
+                flat_map.append(g.to_overview_celldl(2, depth, class_filter, detail))
+        for c in connections:
+            flat_map.append(c.to_celldl(2))
+        nodes = []
+        for (g, level) in glyphs:
+            node = dict(id=g.id, name=g.label, type=g.primary_class)
+            if g.parent is not None:
+                node['group'] = g.parent.id
+            if level == depth and g.children:
+                node['collapsed'] = sum(1 for _ in g.subtree()) - 1
+            if g in internal:
+                node['internal'] = internal[g]
+            nodes.append(node)
+        return {
+            '{}-overview.celldl'.format(name): celldl_document(flat_map,
+                                                   self.style(2, [g for (g, level) in glyphs])),
+            '{}-overview.json'.format(name): json.dumps({
+                'depth': depth,
+                'detail': detail,
+                'nodes': nodes,
+                'links': [c.to_json() for c in connections]
+                }, sort_keys=True, indent=4, separators=(',', ': '))
+            }
+
+    def to_celldl_tiles(self, name, class_filter=None):
+        # Each top-level compartment's subtree goes into its own tile, with
+        # a coarse overview of the top-level glyphs linking to the tiles.
+        # Connections crossing tiles are kept in the tiles at both of their
+        # ends, with the remote end shown as a stub, and are collapsed onto
+        # the top-level glyphs in the overview.
+        overview_file = '{}-tiles.celldl'.format(name)
+        tile_files = {}
+        for g in self._root_glyphs:
+            if g.is_a('compartment') and (class_filter is None or g.primary_class in class_filter):
+                tile_files[g.id] = '{}-{}.celldl'.format(name, g.id)
+        tile_connections = {tile: [] for tile in tile_files}
+        overview_connections = {}
+        links = []
+        for c in self._connections:
+            source_top = self._top_level(c.source)
+            target_top = self._top_level(c.target)
+            source_tile = source_top.id if source_top.id in tile_files else None
+            target_tile = target_top.id if target_top.id in tile_files else None
+            if source_tile is None and target_tile is None:
+                overview_connections[(c.source.id, c.target.id, c.type)] = c
+                continue
+            for tile in set([source_tile, target_tile]):
+                if tile is not None:
+                    tile_connections[tile].append(c)
+            if source_tile != target_tile:
+                links.append(dict(source=c.source.id, target=c.target.id,
+                                  source_tile=source_tile, target_tile=target_tile,
+                                  type=c.type))
+                key = (source_top.id, target_top.id, c.type)
+                if key not in overview_connections:
+                    overview_connections[key] = Connection(source_top, target_top, c.type)
+
+        files = {}
+        tiles = []
+        for g in self._root_glyphs:
+            if g.id not in tile_files:
+                continue
+            stubs = {}
+            for c in tile_connections[g.id]:
+                for end in [c.source, c.target]:
+                    if self._top_level(end) is not g:
+                        stubs[end.id] = end
+            flat_map = [g.to_celldl(2, class_filter)]
+            for stub in stubs.values():
+                flat_map.append(stub.to_tile_reference(2,
+                    tile_files.get(self._top_level(stub).id, overview_file), stub=True))
+            for c in tile_connections[g.id]:
+                flat_map.append(c.to_celldl(2))
+            style = [self.style(2, g.subtree()), STUB_STYLE_RULES]
+            for stub in stubs.values():
+                style.append(stub.style(2, self._top_level(stub).position))
+            files[tile_files[g.id]] = celldl_document(flat_map, '\n'.join(style))
+            tiles.append(dict(id=g.id, label=g.label, file=tile_files[g.id],
+                              position=g.position, size=g.size,
+                              connections=len(tile_connections[g.id])))
+
+        flat_map = []
+        for g in self._root_glyphs:
+            if g.id in tile_files:
+                flat_map.append(g.to_tile_reference(2, tile_files[g.id]))
+            elif class_filter is None or g.primary_class in class_filter:
+                flat_map.append(g.to_celldl(2, class_filter))
+        for c in overview_connections.values():
+            flat_map.append(c.to_celldl(2))
+        files[overview_file] = celldl_document(flat_map, self.style(2, self._root_glyphs))
+
+        (width, height) = self._geometry.absolute_size()
+        files['{}-tiles.json'.format(name)] = json.dumps({
+            'overview': overview_file,
+            'width': width,
+            'height': height,
+            'tiles': tiles,
+            'links': links
+            }, sort_keys=True, indent=4, separators=(',', ': '))
+        return files
+
+    def _json_build(self, glyph, context, class_filter=None, selection=None):
         if len(glyph.children) == 0:
             size = glyph.size
-            self._json_nodes.append(dict(index=self._json_node_index,
-                                         name=glyph.label,
-                                         width=size[0],
-                                         height=size[1],
-                                         type=glyph.primary_class))
-            glyph.set_index(self._json_node_index)
+            index = len(context.nodes)
+            context.nodes.append(dict(index=index,
+                                      name=glyph.label,
+                                      width=size[0],
+                                      height=size[1],
+                                      type=glyph.primary_class))
+            context.glyphs.append(glyph)
+            context.indices[glyph] = index
             if glyph.parent is not None:
-                self._json_groups[glyph.parent.id].leaves.append(glyph.index)
-            self._json_node_index += 1
+                context.groups[glyph.parent.id].leaves.append(index)
         else:
-            if glyph.id not in self._json_groups:
-                self._json_groups[glyph.id] = Group(self._json_group_count)
-                self._json_group_count += 1
+            if glyph.id not in context.groups:
+                context.groups[glyph.id] = Group(len(context.groups))
             if glyph.parent is not None:
-                self._json_groups[glyph.parent.id].groups.append(glyph.id)
+                context.groups[glyph.parent.id].groups.append(glyph.id)
             for c in glyph.children:
-                if class_filter is None or c.primary_class in class_filter:
-                    self._json_build(c, class_filter)
-
-    def to_json(self, class_filter=None):
-        self._json_nodes = []
-        self._json_node_index = 0
-        self._json_groups = {}
-        self._json_group_count = 0
+                if ((class_filter is None or c.primary_class in class_filter)
+                and (selection is None or c in selection)):
+                    self._json_build(c, context, class_filter, selection)
+
+    def to_json(self, class_filter=None, selection=None, constraint_density=CONSTRAINT_DENSITY):
+        context = JsonContext()
         for g in self._root_glyphs:
-            if class_filter is None or g.primary_class in class_filter:
-                self._json_build(g, class_filter)
+            if ((class_filter is None or g.primary_class in class_filter)
+            and (selection is None or g in selection)):
+                self._json_build(g, context, class_filter, selection)
 
-        groups = self._json_group_count*[None]
-        for g in self._json_groups.values():
+        groups = len(context.groups)*[None]
+        for g in context.groups.values():
             groups[g.index] = dict(leaves = g.leaves,
-                                   groups = [self._json_groups[id].index for id in g.groups])
+                                   groups = [context.groups[id].index for id in g.groups])
 
-        return { 'nodes': self._json_nodes,
-                 'links': [dict(source=self._glyphs[a.source].index,
-                                      target=self._glyphs[a.target].index,
-                                      type=a.primary_class) for a in self._arcs],
+        if selection is None:
+            links = [dict(source=context.indices.get(self._glyphs[a.source]),
+                          target=context.indices.get(self._glyphs[a.target]),
+                          type=a.primary_class) for a in self._arcs
+                                                  if a.source in self._glyphs and a.target in self._glyphs]
+        else:
+            # A neighbourhood's arcs have been resolved into connections
+            links = [dict(source=context.indices.get(c.source),
+                          target=context.indices.get(c.target),
+                          type=TYPE_TO_CLASS.get(c.type)) for c in selection.connections]
+        # Arcs end at processes, which aren't usually nodes, so separations
+        # are between the ends of the connections that processes make
+        constraints = LayoutConstraints(context.glyphs,
+                                        [(context.indices.get(c.source), context.indices.get(c.target))
+                                            for c in (self._connections if selection is None
+                                                                        else selection.connections)],
+                                        constraint_density)
+        return { 'nodes': context.nodes,
+                 'links': links,
                  'groups': groups,
-                 'constraints': [],
+                 'constraints': constraints.constraints(),
                }
 
     def to_turtle(self, class_filter=None):
@@ -633,42 +1362,169 @@ class SBGN_ML(object):
             turtle.append(g.to_turtle())
         return '\n'.join(turtle)
 
-    def style(self, level):
+    def style(self, level, glyphs=None):
         styling = [ '''cell-diagram {{
     width: {};
     height: {};
 }}'''.format(*self._geometry.absolute_size())]
         styling.append(DEFAULT_STYLE_RULES)
-        for g in self._glyphs.values():
+        for g in (self._glyphs.values() if glyphs is None else glyphs):
             styling.append(g.style(level))
         return '\n'.join(styling)
 
 # -----------------------------------------------------------------------------
 
-if __name__ == '__main__':
-    import sys
-
-    if len(sys.argv) < 3 or sys.argv[1] not in ['celldl', 'json', 'rdf']:
-        sys.exit('Usage: {} [ celldl | json | rdf ] SBGNML_FILE'.format(sys.argv[0]))
+UTF8_BOM = b'\xef\xbb\xbf'  # Unicode file marker
+
+def parse_sbgnml(filename):
+    # The parser reads straight from the memory mapped file (or decompressed
+    # stream), so the document is never copied before being parsed
+    if filename.endswith('.gz'):
+        with gzip.open(filename, 'rb') as f:
+            return etree.parse(f).getroot()
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped, so have the parser report them
+            return etree.parse(f).getroot()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = len(UTF8_BOM) if mapped[:len(UTF8_BOM)] == UTF8_BOM else 0
+            with memoryview(mapped)[start:] as document:
+                return etree.fromstring(document)
+
+
+def load_sbgnml(filename, infer_compartments=False, diagnostics=None):
+    sbgn = SBGN_ML(parse_sbgnml(filename), pathlib.Path(os.path.abspath(filename)).as_uri(),
+                   infer_compartments=infer_compartments, diagnostics=diagnostics)
+    sbgn.assign_links()
+    return sbgn
+
+
+def serialise(sbgn, output_format, class_filter=CLASS_LIST, selection=None,
+              constraint_density=CONSTRAINT_DENSITY):
+    if   output_format == 'celldl':
+        return sbgn.to_celldl(class_filter, selection)
+    elif output_format == 'json':
+        return json.dumps(sbgn.to_json(class_filter, selection, constraint_density), sort_keys=True,
+                          indent=4, separators=(',', ': '))
+    elif output_format == 'rdf':
+        return sbgn.to_turtle(class_filter)
+    elif output_format == 'svg':
+        return svg_render.render_celldl(sbgn.to_celldl(class_filter, selection))
+    raise ValueError('Unknown output format: {}'.format(output_format))
+
+
+def serialise_all(sbgn, output_formats, class_filter=CLASS_LIST, selection=None,
+                  constraint_density=CONSTRAINT_DENSITY, workers=None):
+    # Parse once, write many: each requested format is serialised concurrently
+    # and SVG is rendered from the CellDL that is produced anyway, rather than
+    # converting a second time. Returns a dictionary of results keyed by format.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        if 'celldl' in output_formats or 'svg' in output_formats:
+            futures['celldl'] = executor.submit(sbgn.to_celldl, class_filter, selection)
+        for output_format in output_formats:
+            if output_format not in futures and output_format != 'svg':
+                futures[output_format] = executor.submit(serialise, sbgn, output_format, class_filter,
+                                                         selection, constraint_density)
+        if 'svg' in output_formats:
+            # Submitted after the CellDL so never waits on a task that hasn't started
+            futures['svg'] = executor.submit(lambda: svg_render.render_celldl(futures['celldl'].result()))
+        return {output_format: futures[output_format].result() for output_format in output_formats}
+
+
+def convert_many(filenames, output_format='celldl', workers=None, infer_compartments=False):
+    # Every conversion has its own state, so documents are converted in
+    # parallel threads, overlapping lxml's parsing (which releases the GIL).
+    # Results are in the same order as ``filenames``.
+    def convert(filename):
+        return serialise(load_sbgnml(filename, infer_compartments), output_format)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(convert, filenames))
 
-    BOM = '\ufeff'  # Unicode file marker
-    filename = sys.argv[2]
-    with open(filename, encoding='utf-8') as f:
-        text = f.read()
-        if text.startswith(BOM):
-            text = text[1:]
-        sbgn = SBGN_ML(text.encode('utf-8'), pathlib.Path(os.path.abspath(filename)).as_uri())
+# -----------------------------------------------------------------------------
 
-    sbgn.assign_links()
+if __name__ == '__main__':
+    import argparse
+    import sys
 
-    class_list = ['compartment', 'macromolecule'] # if --no-processes else None
-    if   sys.argv[1] == 'celldl':
-        print(sbgn.to_celldl(class_list))
-    elif sys.argv[1] == 'json':
-        j = sbgn.to_json(class_list)
-        print(json.dumps(j, sort_keys=True,
-                         indent=4, separators=(',', ': ')))
-    elif sys.argv[1] == 'rdf':
-        print(sbgn.to_turtle(class_list))
+    def format_list(value):
+        formats = value.split(',')
+        for output_format in formats:
+            if output_format not in OUTPUT_FORMATS + FILE_SET_FORMATS:
+                raise argparse.ArgumentTypeError('invalid format: {} (choose from {})'.format(
+                    output_format, ', '.join(OUTPUT_FORMATS + FILE_SET_FORMATS)))
+        return formats
+
+    parser = argparse.ArgumentParser(description='Extract a cell diagram from an SBGN-ML file.')
+    parser.add_argument('format', metavar='FORMAT', type=format_list,
+                        help='output format ({}), or a comma separated list of formats '
+                             'to write to files in the output directory'.format(', '.join(OUTPUT_FORMATS + FILE_SET_FORMATS)))
+    parser.add_argument('sbgnml_file', metavar='SBGNML_FILE',
+                        help='the SBGN-ML file to convert (may be gzipped)')
+    parser.add_argument('--infer-compartments', action='store_true',
+                        help='use geometric nesting for glyphs without a compartmentRef')
+    parser.add_argument('--output-dir', metavar='DIRECTORY', default='.',
+                        help='where to write tiles and files (default: current directory)')
+    parser.add_argument('--neighbourhood', metavar='NAME', action='append',
+                        help='only output what is near the named glyph (may be repeated)')
+    parser.add_argument('--hops', metavar='K', type=int, default=1,
+                        help='size of the neighbourhood in connections (default: 1)')
+    parser.add_argument('--class', metavar='CLASS', dest='classes', action='append',
+                        help='only extend the neighbourhood to glyphs of this class')
+    parser.add_argument('--connection-type', metavar='TYPE', dest='types', action='append',
+                        help='only extend the neighbourhood along this type of connection')
+    parser.add_argument('--overview-depth', metavar='DEPTH', type=int, default=0,
+                        help='compartment depth below which an overview is collapsed (default: 0)')
+    parser.add_argument('--constraint-density', metavar='D', type=float, default=CONSTRAINT_DENSITY,
+                        help='maximum number of JSON layout constraints per node (default %(default)s)')
+    parser.add_argument('--diagnostics', metavar='JSON_FILE',
+                        help='write conversion issues to a JSON file')
+    parser.add_argument('--max-errors', metavar='N', type=int,
+                        help='fail when more than N distinct errors are found')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='fail at the first error')
+    args = parser.parse_args()
+
+    diagnostics = Diagnostics(0 if args.fail_fast else args.max_errors)
+
+    def report_diagnostics():
+        if diagnostics.errors or diagnostics.warnings:
+            print(diagnostics.summary(), file=sys.stderr)
+        if args.diagnostics:
+            with open(args.diagnostics, 'w', encoding='utf-8') as f:
+                json.dump(diagnostics.to_json(), f, sort_keys=True,
+                          indent=4, separators=(',', ': '))
+
+    filename = args.sbgnml_file
+    try:
+        sbgn = load_sbgnml(filename, args.infer_compartments, diagnostics)
+    except ConversionError as error:
+        report_diagnostics()
+        sys.exit(str(error))
+    report_diagnostics()
+
+    selection = (sbgn.neighbourhood(args.neighbourhood, args.hops, args.classes, args.types)
+                    if args.neighbourhood else None)
+    name = pathlib.Path(filename).name.split('.')[0]
+    output_formats = [f for f in args.format if f not in FILE_SET_FORMATS]
+    if len(args.format) == 1 and output_formats:
+        print(serialise(sbgn, output_formats[0], CLASS_LIST, selection, args.constraint_density))
+    elif output_formats:
+        os.makedirs(args.output_dir, exist_ok=True)
+        results = serialise_all(sbgn, output_formats, CLASS_LIST, selection, args.constraint_density)
+        for output_format, contents in results.items():
+            with open(os.path.join(args.output_dir, name + FILE_EXTENSIONS[output_format]),
+                      'w', encoding='utf-8') as f:
+                f.write(contents)
+    files = {}
+    if 'tiles' in args.format:
+        files.update(sbgn.to_celldl_tiles(name, CLASS_LIST))
+    if 'overview' in args.format:
+        files.update(sbgn.to_overview(name, args.overview_depth, CLASS_LIST))
+    if files:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for filename, contents in files.items():
+            with open(os.path.join(args.output_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(contents)
 
 # -----------------------------------------------------------------------------
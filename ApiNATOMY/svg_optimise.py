@@ -0,0 +1,503 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import json
+from lxml import etree
+import math
+import os
+import re
+
+# Rendering tiles is optional and needs Cairo
+
+try:
+    import cairosvg
+except (ImportError, OSError):
+    cairosvg = None
+
+# -----------------------------------------------------------------------------
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+def svg_tag(tag):
+    return '{{{}}}{}'.format(SVG_NS, tag)
+
+# Elements and attributes only of interest to drawing editors
+
+EDITOR_NAMESPACES = ['http://www.inkscape.org/namespaces/inkscape',
+                     'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd',
+                     'http://ns.adobe.com/AdobeIllustrator/10.0/',
+                    ]
+
+# Attributes holding a single coordinate, those holding lists of coordinates,
+# and transforms, whose matrix and scale factors can't lose decimal places
+
+NUMBER_ATTRIBUTES = ['cx', 'cy', 'height', 'r', 'rx', 'ry', 'width',
+                     'x', 'x1', 'x2', 'y', 'y1', 'y2']
+NUMBER_LIST_ATTRIBUTES = ['d', 'points']
+TRANSFORM_ATTRIBUTES = ['gradientTransform', 'patternTransform', 'transform']
+
+# Paths with any of these properties look different when drawn as one
+
+UNMERGEABLE_PROPERTIES = ['filter', 'fill-opacity', 'marker', 'marker-end', 'marker-mid',
+                          'marker-start', 'mask', 'mix-blend-mode', 'opacity', 'stroke-opacity']
+
+DEFAULT_PRECISION = 2
+TRANSFORM_SIGNIFICANT_DIGITS = 6
+DEFAULT_TILE_SIZE = 256
+
+# -----------------------------------------------------------------------------
+
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+REFERENCE = re.compile(r'url\(\s*[\'"]?#([^\'")\s]+)')
+ID_SELECTOR = re.compile(r'#([-\w]+)')
+CSS_RULE = re.compile(r'([^{}]+)\{([^}]*)\}')
+RELATIVE_MOVE = re.compile(r'^\s*m\s*({0})[\s,]*({0})(.*)$'.format(NUMBER.pattern), re.DOTALL)
+PATH_COMMAND = re.compile(r'[\s,]*([MmZzLlHhVvCcSsQqTt])')
+PATH_NUMBER = re.compile(r'[\s,]*({})'.format(NUMBER.pattern))
+
+# The number of values each path command takes
+
+PATH_ARGUMENTS = {'m': 2, 'z': 0, 'l': 2, 'h': 1, 'v': 1, 'c': 6, 's': 4, 'q': 4, 't': 2}
+
+def format_number(value, precision):
+    text = '{:.{}f}'.format(round(value, precision), precision)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text in ['-0', '']:
+        text = '0'
+    if text.startswith('0.'):
+        text = text[1:]
+    elif text.startswith('-0.'):
+        text = '-' + text[2:]
+    return text
+
+
+def round_numbers(text, precision, significant=None):
+    # With ``significant``, numbers keep at least that many significant digits
+    # as well as ``precision`` decimal places
+    previous = [None, '']       # Where the last number ended and its new text
+    def rounded(match):
+        number = match.group(0)
+        # Arc flags may be written without separators (e.g. ``011``)
+        if len(number) > 1 and number[0] == '0' and number[1].isdigit():
+            result = number
+        else:
+            value = float(number)
+            places = precision
+            if significant is not None and value != 0 and math.isfinite(value):
+                places = max(places, significant - 1 - int(math.floor(math.log10(abs(value)))))
+            result = format_number(value, places)
+        # Numbers needn't be separated before a sign or decimal point (e.g.
+        # ``1.001.5``), which rounding may have removed or made ambiguous
+        if (match.start() == previous[0] and result[0] != '-'
+        and (result[0] != '.' or '.' not in previous[1])):
+            result = ' ' + result
+        previous[:] = [match.end(), result]
+        return result
+    return NUMBER.sub(rounded, text)
+
+
+def absolute_start(path):
+    # A path's initial ``m`` is absolute but would be relative once the path
+    # is appended to another, so make it explicit
+    match = RELATIVE_MOVE.match(path)
+    if match is None:
+        return path
+    rest = match.group(3)
+    if rest.strip() and not rest.strip()[0].isalpha():
+        rest = 'l' + rest      # Following coordinate pairs are relative lines
+    return 'M{} {}{}'.format(match.group(1), match.group(2), rest)
+
+
+def path_bounds(path):
+    # The bounds of a path's points, as ``(left, top, right, bottom)``. These
+    # contain what is drawn, as curves lie within their control points. Paths
+    # with arcs, or that can't be read, have no bounds.
+    points = []
+    (x, y) = start = (0.0, 0.0)
+    command = None
+    position = 0
+    path = path.rstrip()
+    while position < len(path):
+        match = PATH_COMMAND.match(path, position)
+        if match is not None:
+            command = match.group(1)
+            position = match.end()
+        elif command is None or command in 'Zz':
+            return None
+        if command in 'Zz':
+            (x, y) = start
+            continue
+        values = []
+        for n in range(PATH_ARGUMENTS[command.lower()]):
+            match = PATH_NUMBER.match(path, position)
+            if match is None:
+                return None
+            values.append(float(match.group(1)))
+            position = match.end()
+        (dx, dy) = (x, y) if command.islower() else (0.0, 0.0)
+        if command in 'Hh':
+            x = values[0] + dx
+        elif command in 'Vv':
+            y = values[0] + dy
+        else:
+            for n in range(0, len(values), 2):
+                points.append((values[n] + dx, values[n+1] + dy))
+            (x, y) = points[-1]
+        points.append((x, y))
+        if command in 'Mm':
+            start = (x, y)
+            command = 'l' if command == 'm' else 'L'    # Any further pairs are lines
+    if not points:
+        return None
+    return (min(p[0] for p in points), min(p[1] for p in points),
+            max(p[0] for p in points), max(p[1] for p in points))
+
+
+def disjoint(bounds, other):
+    return (bounds is not None and other is not None
+        and (bounds[2] <= other[0] or other[2] <= bounds[0]
+          or bounds[3] <= other[1] or other[3] <= bounds[1]))
+
+
+# -----------------------------------------------------------------------------
+
+class SvgOptimiser(object):
+    def __init__(self, svg, precision=DEFAULT_PRECISION):
+        parser = etree.XMLParser(remove_comments=True, huge_tree=True)
+        self._root = etree.fromstring(svg, parser) if isinstance(svg, bytes) else svg
+        self._precision = precision
+        self._class_properties = {}
+        # What stylesheet rules refer to, by class for simple class selectors
+        self._class_references = {}
+        self._style_references = set()
+        # Whether rules other than for a single class may set fills
+        self._styled_fills = False
+        for style in self._root.iter(svg_tag('style')):
+            for (selectors, declarations) in CSS_RULE.findall(style.text or ''):
+                properties = {}
+                for declaration in declarations.split(';'):
+                    if ':' in declaration:
+                        (name, value) = declaration.split(':', 1)
+                        properties[name.strip()] = value.strip()
+                ids = set(REFERENCE.findall(declarations))
+                # Elements a rule selects by id are referred to by the stylesheet
+                self._style_references.update(ID_SELECTOR.findall(selectors))
+                for selector in selectors.split(','):
+                    selector = selector.strip()
+                    if re.match(r'^\.[\w-]+$', selector):
+                        self._class_properties.setdefault(selector[1:], {}).update(properties)
+                        self._class_references.setdefault(selector[1:], set()).update(ids)
+                    else:
+                        self._style_references.update(ids)
+                        if 'fill' in properties:
+                            self._styled_fills = True
+
+    @property
+    def root(self):
+        return self._root
+
+    def _references(self, element):
+        # The ids an element refers to, either through ``url(#id)``, ``href="#id"``
+        # or its classes' style rules
+        ids = set()
+        for (name, value) in element.attrib.items():
+            if name in [XLINK_HREF, 'href'] and value.startswith('#'):
+                ids.add(value[1:])
+            else:
+                ids.update(REFERENCE.findall(value))
+        for cls in element.get('class', '').split():
+            ids.update(self._class_references.get(cls, set()))
+        return ids
+
+    def _remove(self, element):
+        # Keep the text that follows an element being removed
+        parent = element.getparent()
+        if element.tail and element.tail.strip():
+            previous = element.getprevious()
+            if previous is not None:
+                previous.tail = (previous.tail or '') + element.tail
+            else:
+                parent.text = (parent.text or '') + element.tail
+        parent.remove(element)
+
+    def _strip_editor_data(self):
+        for element in list(self._root.iter(svg_tag('metadata'), svg_tag('title'))):
+            self._remove(element)
+        for element in list(self._root.iter()):
+            if not isinstance(element.tag, str):
+                self._remove(element)      # Processing instructions
+            elif etree.QName(element).namespace in EDITOR_NAMESPACES:
+                self._remove(element)
+            else:
+                for name in list(element.attrib):
+                    if etree.QName(name).namespace in EDITOR_NAMESPACES or name == 'data-name':
+                        del element.attrib[name]
+        etree.cleanup_namespaces(self._root)
+
+    def _strip_whitespace(self):
+        # Whitespace is only significant inside text
+        for element in self._root.iter():
+            if element.tag in [svg_tag('text'), svg_tag('tspan'), svg_tag('style')]:
+                continue
+            if element.text is not None and not element.text.strip():
+                element.text = None
+            parent = element.getparent()
+            if (element.tail is not None and not element.tail.strip()
+             and (parent is None or parent.tag not in [svg_tag('text'), svg_tag('tspan')])):
+                element.tail = None
+
+    def _round_numbers(self):
+        for element in self._root.iter():
+            if element is self._root or not isinstance(element.tag, str):
+                continue
+            for name in NUMBER_ATTRIBUTES:
+                value = element.get(name)
+                if value is not None and not value.endswith('%'):
+                    element.set(name, round_numbers(value, self._precision))
+            for name in NUMBER_LIST_ATTRIBUTES:
+                value = element.get(name)
+                if value is not None:
+                    element.set(name, round_numbers(value, self._precision))
+            for name in TRANSFORM_ATTRIBUTES:
+                value = element.get(name)
+                if value is not None:
+                    element.set(name, round_numbers(value, self._precision, TRANSFORM_SIGNIFICANT_DIGITS))
+
+    def _properties(self, element):
+        # Style rules override presentation attributes and are overridden
+        # by the element's own style
+        properties = dict(element.attrib)
+        for cls in element.get('class', '').split():
+            properties.update(self._class_properties.get(cls, {}))
+        for declaration in element.get('style', '').split(';'):
+            if ':' in declaration:
+                (name, value) = declaration.split(':', 1)
+                properties[name.strip()] = value.strip()
+        return properties
+
+    def _filled(self, element):
+        # Fills are inherited and are black unless set otherwise
+        if self._styled_fills:
+            return True
+        for e in [element] + list(element.iterancestors()):
+            fill = self._properties(e).get('fill')
+            if fill is not None and fill != 'inherit':
+                return fill != 'none'
+        return True
+
+    def _mergeable(self, element):
+        if (element.tag != svg_tag('path') or len(element) or element.get('id')
+         or element.get('d') is None):
+            return False
+        properties = self._properties(element)
+        return not any(name in properties for name in UNMERGEABLE_PROPERTIES)
+
+    def _merge_paths(self):
+        # Adjacent sibling paths that differ only in their path data are drawn
+        # as a single path. Where filled subpaths overlap, whichever the fill
+        # rule, the overlap can become a hole, so filled paths are only merged
+        # when their bounds are apart from those of the paths already merged.
+        merged = 0
+        for parent in list(self._root.iter()):
+            previous = None
+            for element in list(parent):
+                if not self._mergeable(element):
+                    previous = None
+                    continue
+                filled = self._filled(element)
+                bounds = path_bounds(element.get('d')) if filled else None
+                if (previous is not None
+                and {k: v for (k, v) in previous.attrib.items() if k != 'd'}
+                 == {k: v for (k, v) in element.attrib.items() if k != 'd'}
+                and not (previous.tail or '').strip()
+                and (not filled or all(disjoint(bounds, b) for b in merged_bounds))):
+                    previous.set('d', '{} {}'.format(previous.get('d').rstrip(),
+                                                     absolute_start(element.get('d').strip())))
+                    self._remove(element)
+                    merged_bounds.append(bounds)
+                    merged += 1
+                else:
+                    previous = element
+                    merged_bounds = [bounds]
+        return merged
+
+    def _strip_ids(self, keep_ids):
+        # Ids that nothing refers to stop paths being merged
+        referenced = set(self._style_references)
+        for element in self._root.iter():
+            if isinstance(element.tag, str):
+                referenced.update(self._references(element))
+        for element in self._root.iter():
+            if (isinstance(element.tag, str) and element.get('id') is not None
+            and element.get('id') not in referenced and element.get('id') not in keep_ids):
+                del element.attrib['id']
+
+    def _remove_unused_definitions(self):
+        # Definitions are kept when they can be reached from what is drawn
+        ids = {e.get('id'): e for e in self._root.iter() if isinstance(e.tag, str) and e.get('id')}
+        definitions = list(self._root.iter(svg_tag('defs')))
+        defined = set()
+        for defs in definitions:
+            for element in defs.iter():
+                defined.add(element)
+        referenced = set()
+        pending = list(self._style_references)
+        for element in self._root.iter():
+            if isinstance(element.tag, str) and element not in defined:
+                pending.extend(self._references(element))
+        while pending:
+            id = pending.pop()
+            if id in referenced or id not in ids:
+                continue
+            referenced.add(id)
+            for element in ids[id].iter():
+                pending.extend(self._references(element))
+        removed = 0
+        for defs in definitions:
+            for element in list(defs):
+                if element.tag == svg_tag('style'):
+                    continue
+                if not any(e.get('id') in referenced for e in element.iter()
+                                                        if isinstance(e.tag, str)):
+                    self._remove(element)
+                    removed += 1
+            if len(defs) == 0 and defs.get('id') not in referenced:
+                self._remove(defs)
+        return removed
+
+    def optimise(self, merge_paths=True, keep_ids=None):
+        # Ids are only removed when ``keep_ids`` lists those used from outside
+        # the SVG, such as by a diagram's background regions
+        self._strip_editor_data()
+        self._remove_unused_definitions()
+        if keep_ids is not None:
+            self._strip_ids(set(keep_ids))
+        self._round_numbers()
+        if merge_paths:
+            self._merge_paths()
+        self._strip_whitespace()
+        return self
+
+    def to_string(self):
+        return etree.tostring(self._root, encoding='unicode')
+
+# -----------------------------------------------------------------------------
+
+def optimise_svg(svg, precision=DEFAULT_PRECISION, merge_paths=True, keep_ids=None):
+    # ``svg`` is the bytes of an SVG document; the result is text
+    return SvgOptimiser(svg, precision).optimise(merge_paths, keep_ids).to_string()
+
+
+def region_ids(diagram_file):
+    # The SVG elements a diagram's background regions are positioned by
+    root = etree.parse(diagram_file).getroot()
+    return [region.get('region') for region in root.iter('{*}region') if region.get('region')]
+
+# -----------------------------------------------------------------------------
+
+# A tile pyramid has the whole background in a single tile at level 0 and
+# twice as many tiles across each axis at each following level. Tiles cover
+# square regions of the background's ``viewBox``, so tile coordinates map
+# directly to those of the diagram the background is drawn under.
+
+def view_box(root):
+    if root.get('viewBox'):
+        return [float(v) for v in root.get('viewBox').replace(',', ' ').split()]
+    return [0.0, 0.0, float(NUMBER.match(root.get('width')).group(0)),
+                      float(NUMBER.match(root.get('height')).group(0))]
+
+
+def tile_pyramid(svg, output_dir, levels, tile_size=DEFAULT_TILE_SIZE):
+    if cairosvg is None:
+        raise ImportError('Rendering tiles needs the cairosvg package')
+    root = etree.fromstring(svg, etree.XMLParser(huge_tree=True))
+    (x, y, width, height) = view_box(root)
+    extent = max(width, height)
+    tiles = []
+    for level in range(levels):
+        count = 2**level
+        tile_extent = extent/count
+        for column in range(int(math.ceil(count*width/extent))):
+            for row in range(int(math.ceil(count*height/extent))):
+                root.set('viewBox', '{} {} {} {}'.format(x + column*tile_extent,
+                                                         y + row*tile_extent,
+                                                         tile_extent, tile_extent))
+                root.set('width', str(tile_size))
+                root.set('height', str(tile_size))
+                tile = os.path.join(str(level), str(column), '{}.png'.format(row))
+                os.makedirs(os.path.join(output_dir, os.path.dirname(tile)), exist_ok=True)
+                cairosvg.svg2png(bytestring=etree.tostring(root),
+                                 write_to=os.path.join(output_dir, tile))
+                tiles.append(tile)
+    manifest = os.path.join(output_dir, 'tiles.json')
+    with open(manifest, 'w', encoding='utf-8') as f:
+        json.dump({
+            'viewBox': [x, y, width, height],
+            'extent': extent,
+            'levels': levels,
+            'tile-size': tile_size,
+            'tiles': tiles
+            }, f, sort_keys=True, indent=4, separators=(',', ': '))
+    return manifest
+
+# -----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Minify a background SVG and optionally render it as tiles.')
+    parser.add_argument('svg_file', metavar='SVG_FILE',
+                        help='the background SVG to optimise')
+    parser.add_argument('output', metavar='OUTPUT', nargs='?',
+                        help='where to write the optimised SVG (default: stdout)')
+    parser.add_argument('--precision', metavar='N', type=int, default=DEFAULT_PRECISION,
+                        help='decimal places kept in coordinates (default: %(default)s)')
+    parser.add_argument('--no-merge', action='store_true',
+                        help="don't merge adjacent paths")
+    parser.add_argument('--diagram', metavar='DIAGRAM_FILE', action='append',
+                        help='remove ids not needed by the regions of this diagram (may be repeated)')
+    parser.add_argument('--tiles', metavar='DIRECTORY',
+                        help='also render a tile pyramid into DIRECTORY (needs cairosvg)')
+    parser.add_argument('--levels', metavar='N', type=int, default=4,
+                        help='number of levels in the tile pyramid (default: %(default)s)')
+    parser.add_argument('--tile-size', metavar='PIXELS', type=int, default=DEFAULT_TILE_SIZE,
+                        help='width and height of tiles (default: %(default)s)')
+    args = parser.parse_args()
+
+    with open(args.svg_file, 'rb') as f:
+        svg = optimise_svg(f.read(), args.precision, not args.no_merge,
+                           [id for diagram in args.diagram for id in region_ids(diagram)]
+                               if args.diagram else None)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(svg)
+    else:
+        print(svg)
+    if args.tiles:
+        try:
+            print(tile_pyramid(svg.encode('utf-8'), args.tiles, args.levels, args.tile_size),
+                  file=sys.stderr)
+        except ImportError as error:
+            sys.exit(str(error))
+
+# -----------------------------------------------------------------------------
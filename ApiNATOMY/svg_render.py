@@ -0,0 +1,245 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import math
+import os
+from xml.sax.saxutils import escape
+
+import celldl_reader
+
+# -----------------------------------------------------------------------------
+
+# Percentage range for automatically placing elements in a component
+
+MIN_POS =  5
+MAX_POS = 95
+
+# -----------------------------------------------------------------------------
+
+INDENT = 4
+
+DEFAULT_DIAGRAM_SIZE = (1000, 1000)
+DEFAULT_SIZE = [(2, 'v'), (2, 'v')]
+DEFAULT_LINE_COLOUR = '#808080'
+
+# Rounded rectangles have corner radii of this fraction of their size, as in
+# ``script/elements.js``
+
+CORNER_RADIUS = 0.2
+
+# -----------------------------------------------------------------------------
+
+class Box(object):
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    @property
+    def origin(self):
+        return (self.x - self.width/2.0, self.y - self.height/2.0)
+
+    def boundary_point(self, towards):
+        # Where the line from our centre towards a point leaves the box
+        dx = towards[0] - self.x
+        dy = towards[1] - self.y
+        scales = []
+        if dx != 0:
+            scales.append(self.width/(2.0*abs(dx)))
+        if dy != 0:
+            scales.append(self.height/(2.0*abs(dy)))
+        scale = min(scales + [1.0]) if scales else 0.0
+        return (self.x + scale*dx, self.y + scale*dy)
+
+# -----------------------------------------------------------------------------
+
+class SvgRenderer(object):
+    def __init__(self, diagram):
+        self._diagram = diagram
+        self._size = diagram.size if diagram.size is not None else DEFAULT_DIAGRAM_SIZE
+        self._boxes = {}
+
+    def _length(self, length, index, container):
+        (value, units) = length
+        if units in ['', 'px']:
+            return value
+        elif units == '%':
+            return value*(container.width if index == 0 else container.height)/100.0
+        elif 'w' in units:
+            return value*self._size[0]/100.0
+        elif 'h' in units:
+            return value*self._size[1]/100.0
+        else:
+            return value*self._size[index]/100.0
+
+    def _coordinate(self, length, index, container):
+        if length[1] == '%':
+            return container.origin[index] + self._length(length, index, container)
+        return self._length(length, index, container)
+
+    def _stroke_width(self, value):
+        lengths = celldl_reader.parse_lengths(value) if value else None
+        if not lengths:
+            return 1.0
+        (width, units) = lengths[0]
+        if units == '%':
+            return width*math.hypot(*self._size)/100.0
+        elif units in ['v', 'vw', 'vh']:
+            return width*self._size[0 if units != 'vh' else 1]/100.0
+        return width
+
+    def _layout(self, components, container):
+        # Components without a position are spread over a grid in their container
+        unplaced = [c for c in components if c.position is None]
+        columns = int(math.ceil(math.sqrt(len(unplaced)))) if unplaced else 1
+        rows = int(math.ceil(len(unplaced)/columns)) if unplaced else 1
+        n = 0
+        for c in components:
+            size = c.size if c.size is not None else DEFAULT_SIZE
+            width = self._length(size[0], 0, container)
+            height = self._length(size[1], 1, container)
+            if c.position is not None:
+                x = self._coordinate(c.position[0], 0, container)
+                y = self._coordinate(c.position[1], 1, container)
+            else:
+                x = self._coordinate((MIN_POS + (MAX_POS-MIN_POS)*(n % columns + 0.5)/columns, '%'),
+                                     0, container)
+                y = self._coordinate((MIN_POS + (MAX_POS-MIN_POS)*(n // columns + 0.5)/rows, '%'),
+                                     1, container)
+                n += 1
+            box = Box(x, y, width, height)
+            self._boxes[c] = box
+            self._layout(c.children, box)
+
+    def _component_svg(self, component, level, font_size):
+        indent = INDENT*level*' '
+        box = self._boxes[component]
+        style = component.style
+        (x, y) = box.origin
+        attributes = ['x="{:.2f}" y="{:.2f}" width="{:.2f}" height="{:.2f}"'.format(x, y,
+                                                                               box.width, box.height)]
+        if style.get('shape') == 'rounded-rectangle':
+            attributes.append('rx="{:.2f}" ry="{:.2f}"'.format(CORNER_RADIUS*box.width,
+                                                               CORNER_RADIUS*box.height))
+        attributes.append('fill="{}"'.format(escape(style.get('color', 'none'))))
+        if style.get('stroke', 'none') != 'none':
+            attributes.append('stroke="{}" stroke-width="{:.2f}"'.format(escape(style['stroke']),
+                                                                         self._stroke_width(style.get('stroke-width'))))
+        if 'opacity' in style:
+            attributes.append('opacity="{}"'.format(escape(style['opacity'])))
+        svg = ['{}<g id="{}" class="{}">'.format(indent, escape(component.id or ''),
+                                                 escape(' '.join(component.classes)))]
+        svg.append('{}<rect {}/>'.format(indent + INDENT*' ', ' '.join(attributes)))
+        if component.label and component.label != '_':
+            text_position = celldl_reader.parse_lengths(style.get('text-position', '50%, 50%'))
+            if text_position is None:
+                text_position = [(50, '%'), (50, '%')]
+            svg.append('{}<text x="{:.2f}" y="{:.2f}" font-size="{:.2f}" text-anchor="middle" dominant-baseline="central">{}</text>'.format(
+                       indent + INDENT*' ',
+                       self._coordinate(text_position[0], 0, box),
+                       self._coordinate(text_position[1], 1, box),
+                       font_size, escape(component.label)))
+        for c in component.children:
+            svg.append(self._component_svg(c, level+1, font_size))
+        svg.append('{}</g>'.format(indent))
+        return '\n'.join(svg)
+
+    def render(self):
+        (width, height) = self._size
+        self._boxes = {}
+        self._layout(self._diagram.root_components, Box(width/2.0, height/2.0, width, height))
+        font_size = min(width, height)/80.0
+        boxes = {c.id: self._boxes[c] for c in self._diagram.components}
+        lines = []
+        colours = []
+        for c in self._diagram.connections:
+            source = boxes.get(c.source)
+            target = boxes.get(c.target)
+            if source is None or target is None:
+                continue
+            colour = c.style.get('line-color', DEFAULT_LINE_COLOUR)
+            if colour not in colours:
+                colours.append(colour)
+            (x1, y1) = source.boundary_point((target.x, target.y))
+            (x2, y2) = target.boundary_point((source.x, source.y))
+            lines.append('{}<line x1="{:.2f}" y1="{:.2f}" x2="{:.2f}" y2="{:.2f}" stroke="{}" stroke-width="{:.2f}" stroke-opacity="{}" marker-end="url(#arrow-{})"/>'.format(
+                         2*INDENT*' ', x1, y1, x2, y2, escape(colour),
+                         self._stroke_width(c.style.get('stroke-width')),
+                         escape(c.style.get('stroke-opacity', '1')),
+                         colours.index(colour)))
+        svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" viewBox="0 0 {0} {1}">'.format(width, height)]
+        svg.append('{}<defs>'.format(INDENT*' '))
+        for n, colour in enumerate(colours):
+            svg.append('{}<marker id="arrow-{}" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="4" markerHeight="4" orient="auto"><path d="M0,0 L10,5 L0,10 z" fill="{}"/></marker>'.format(
+                       2*INDENT*' ', n, escape(colour)))
+        svg.append('{}</defs>'.format(INDENT*' '))
+        svg.append('{}<g class="components">'.format(INDENT*' '))
+        for c in self._diagram.root_components:
+            svg.append(self._component_svg(c, 2, font_size))
+        svg.append('{}</g>'.format(INDENT*' '))
+        svg.append('{}<g class="connections">'.format(INDENT*' '))
+        svg.extend(lines)
+        svg.append('{}</g>'.format(INDENT*' '))
+        svg.append('</svg>')
+        return '\n'.join(svg)
+
+# -----------------------------------------------------------------------------
+
+def render(diagram):
+    return SvgRenderer(diagram).render()
+
+
+def render_celldl(text):
+    # ``text`` is the output of a converter's ``to_celldl()``
+    return render(celldl_reader.read_string(text))
+
+
+def preview_filename(celldl_file):
+    return '{}.svg'.format(os.path.splitext(celldl_file)[0])
+
+
+def cached_preview(celldl_file, force=False):
+    # The preview lives next to the CellDL file and is only rendered again
+    # when it is older than the CellDL
+    svg_file = preview_filename(celldl_file)
+    if (force or not os.path.exists(svg_file)
+     or os.path.getmtime(svg_file) < os.path.getmtime(celldl_file)):
+        svg = render(celldl_reader.read(celldl_file))
+        with open(svg_file, 'w', encoding='utf-8') as f:
+            f.write(svg)
+    return svg_file
+
+# -----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Render static SVG previews of CellDL files.')
+    parser.add_argument('celldl_files', metavar='CELLDL_FILE', nargs='+',
+                        help='the CellDL files to render')
+    parser.add_argument('--force', action='store_true',
+                        help='render even when a preview is up to date')
+    args = parser.parse_args()
+
+    for filename in args.celldl_files:
+        print(cached_preview(filename, args.force))
+
+# -----------------------------------------------------------------------------
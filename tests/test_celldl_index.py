@@ -0,0 +1,43 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+from celldl_index import DiagramIndex
+
+from test_convert_many import sbgn_document
+
+# -----------------------------------------------------------------------------
+
+def test_failed_update(tmp_path):
+    diagram = tmp_path/'map.sbgn'
+    diagram.write_bytes(sbgn_document(2))
+    notes = tmp_path/'notes.txt'
+    notes.write_text('not a diagram')
+    with DiagramIndex(str(tmp_path/'index.db')) as index:
+        (indexed, failed) = index.update([str(tmp_path), str(notes)])
+        assert indexed == [str(diagram)]
+        assert [path for (path, error) in failed] == [str(notes)]
+        assert len(index.search('M 1')) == 1
+        # A diagram that can no longer be read is removed from the index
+        diagram.write_bytes(b'')
+        (indexed, failed) = index.update([str(tmp_path)])
+        assert indexed == [] and [path for (path, error) in failed] == [str(diagram)]
+        assert index.search('M 1') == []
+
+# -----------------------------------------------------------------------------
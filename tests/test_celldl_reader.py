@@ -0,0 +1,53 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import celldl_reader
+
+# -----------------------------------------------------------------------------
+
+DIAGRAM = '''<cell-diagram>
+    <background image="background.svg" scale="0.8">
+        <region id="u1_pos" region="svg_region_1"/>
+        <region id="u2_pos" region="svg_region_2"/>
+    </background>
+    <flat-map>
+        <component id="u1" class="neuron" label="U1"/>
+        <component id="u2" class="neuron" label="U2"/>
+        <connection from="u1" to="u2" class="excitatory"/>
+    </flat-map>
+    <style>
+        #u1 {
+            position: u1_pos;
+        }
+    </style>
+</cell-diagram>'''
+
+# -----------------------------------------------------------------------------
+
+def test_background_regions():
+    diagram = celldl_reader.read_string(DIAGRAM)
+    assert [(r.id, r.attributes['region']) for r in diagram.background.regions] == [
+        ('u1_pos', 'svg_region_1'), ('u2_pos', 'svg_region_2')]
+    # Writing what is read and reading it again gives the same diagram
+    celldl = diagram.to_celldl()
+    assert celldl_reader.read_string(celldl).to_celldl() == celldl
+    assert '<region id="u2_pos" region="svg_region_2"/>' in celldl
+
+# -----------------------------------------------------------------------------
@@ -0,0 +1,123 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import gzip
+import os
+
+import pytest
+
+import csv2celldl
+import sbgnml_extract
+
+# -----------------------------------------------------------------------------
+
+# Converting many files in parallel must give what converting them one at a
+# time does, whatever the interleaving of threads
+
+FILE_COUNT = 32
+WORKERS = 8
+
+CONNECTIVITY_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'ApiNATOMY', 'respiratory_control.csv')
+
+# -----------------------------------------------------------------------------
+
+def sbgn_document(n):
+    # A chain of ``n + 2`` macromolecules spread over two nested compartments,
+    # linked through processes' ports and with annotated glyphs
+    glyphs = ['<glyph id="outer" class="compartment"><label text="Outer {}"/>'
+              '<bbox x="0" y="0" w="2000" h="1000"/></glyph>'.format(n),
+              '<glyph id="inner" class="compartment" compartmentRef="outer"><label text="Inner"/>'
+              '<bbox x="100" y="100" w="800" h="600"/></glyph>']
+    arcs = []
+    for i in range(n + 2):
+        compartment = 'inner' if i % 2 else 'outer'
+        glyphs.append('<glyph id="m{0}" class="macromolecule" compartmentRef="{1}">'
+                      '<label text="M {0}"/><bbox x="{2}" y="{3}" w="60" h="30"/>'
+                      '<annotation><rdf:RDF><rdf:Description rdf:about="#m{0}">'
+                      '<bqmodel:isDerivedFrom><rdf:Bag><rdf:li rdf:resource="http://identifiers.org/uniprot:P{0:05d}"/>'
+                      '</rdf:Bag></bqmodel:isDerivedFrom></rdf:Description></rdf:RDF></annotation>'
+                      '</glyph>'.format(i, compartment, 150 + 90*i, 200 + 40*(i % 3)))
+    for i in range(n + 1):
+        glyphs.append('<glyph id="p{0}" class="process"><bbox x="{1}" y="400" w="10" h="10"/>'
+                      '<port id="p{0}.in" x="{1}" y="405"/><port id="p{0}.out" x="{2}" y="405"/>'
+                      '<annotation><rdf:RDF><rdf:Description rdf:about="#p{0}">'
+                      '<bqbiol:is><rdf:Bag><rdf:li rdf:resource="http://identifiers.org/GO:006007{3}"/>'
+                      '</rdf:Bag></bqbiol:is></rdf:Description></rdf:RDF></annotation>'
+                      '</glyph>'.format(i, 190 + 90*i, 200 + 90*i, 6 + i % 2))
+        arcs.append('<arc id="a{0}" class="consumption" source="m{0}" target="p{0}.in">'
+                    '<start x="0" y="0"/><end x="1" y="1"/></arc>'.format(i))
+        arcs.append('<arc id="b{0}" class="production" source="p{0}.out" target="m{1}">'
+                    '<start x="0" y="0"/><end x="1" y="1"/></arc>'.format(i, i + 1))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<sbgn xmlns="http://sbgn.org/libsbgn/0.2"'
+            ' xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"'
+            ' xmlns:bqbiol="http://biomodels.net/biology-qualifiers/"'
+            ' xmlns:bqmodel="http://biomodels.net/model-qualifiers/">'
+            '<map language="process description">{}</map></sbgn>'.format(''.join(glyphs + arcs))).encode('utf-8')
+
+
+@pytest.fixture
+def sbgn_files(tmp_path):
+    files = []
+    for n in range(FILE_COUNT):
+        document = sbgn_document(n)
+        if n % 4 == 3:
+            filename = str(tmp_path/'map{}.sbgn.gz'.format(n))
+            with gzip.open(filename, 'wb') as f:
+                f.write(document)
+        else:
+            filename = str(tmp_path/'map{}.sbgn'.format(n))
+            with open(filename, 'wb') as f:
+                f.write(sbgnml_extract.UTF8_BOM + document if n % 4 == 1 else document)
+        files.append(filename)
+    return files
+
+
+@pytest.fixture
+def csv_files(tmp_path):
+    # Networks of increasing size, taken from the respiratory control model
+    with open(CONNECTIVITY_CSV) as f:
+        lines = f.readlines()
+    files = []
+    for n in range(FILE_COUNT):
+        filename = str(tmp_path/'network{}.csv'.format(n))
+        with open(filename, 'w') as f:
+            f.writelines(lines[:1 + (n + 1)*(len(lines) - 1)//FILE_COUNT])
+        files.append(filename)
+    return files
+
+# -----------------------------------------------------------------------------
+
+@pytest.mark.parametrize('output_format', sbgnml_extract.OUTPUT_FORMATS)
+def test_sbgnml_convert_many(sbgn_files, output_format):
+    expected = [sbgnml_extract.serialise(sbgnml_extract.load_sbgnml(f), output_format)
+                    for f in sbgn_files]
+    assert len(set(expected)) == len(expected)
+    assert sbgnml_extract.convert_many(sbgn_files, output_format, workers=WORKERS) == expected
+
+
+@pytest.mark.parametrize('output_format', csv2celldl.OUTPUT_FORMATS)
+def test_csv2celldl_convert_many(csv_files, output_format):
+    expected = [csv2celldl.serialise(csv2celldl.load_network(f), output_format)
+                    for f in csv_files]
+    assert csv2celldl.convert_many(csv_files, output_format, workers=WORKERS) == expected
+
+# -----------------------------------------------------------------------------
@@ -0,0 +1,86 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import math
+
+import pytest
+
+import csv2celldl
+
+from test_convert_many import CONNECTIVITY_CSV
+
+np = pytest.importorskip('numpy')
+
+# -----------------------------------------------------------------------------
+
+# C has no outgoing synapses and the strength of A to C isn't known
+
+NETWORK_CSV = '''Source population,Target population,Synaptic type,Synaptic strength
+A,B,ex_1,0.5
+A,C,inh_2,
+B,A,ex_1,0.25
+B,B,inh_2,0.125
+'''
+
+def csr_edges(arrays):
+    ids = [str(id) for id in arrays['neurons']['id']]
+    edges = []
+    for row in range(len(ids)):
+        for k in range(arrays['indptr'][row], arrays['indptr'][row + 1]):
+            weight = float(arrays['weight'][k])
+            edges.append((ids[row], ids[arrays['indices'][k]],
+                          str(arrays['edge_types'][arrays['edge_type'][k]]),
+                          None if math.isnan(weight) else weight))
+    return sorted(edges, key=lambda e: e[:3])
+
+
+def synapse_edges(network):
+    return sorted([(s.source, s.target, s.type or '', s.strength) for s in network.synapses],
+                  key=lambda e: e[:3])
+
+# -----------------------------------------------------------------------------
+
+@pytest.mark.parametrize('source', ['small', 'respiratory'])
+def test_csr_round_trip(tmp_path, source):
+    if source == 'small':
+        filename = tmp_path/'network.csv'
+        filename.write_text(NETWORK_CSV)
+        network = csv2celldl.load_network(str(filename))
+    else:
+        network = csv2celldl.load_network(CONNECTIVITY_CSV)
+    directory = network.write_csr(str(tmp_path/'csr'))
+    arrays = csv2celldl.load_csr(directory, mmap_mode='r')
+    assert isinstance(arrays['indptr'], np.memmap)
+    assert len(arrays['indptr']) == len(arrays['neurons']) + 1
+    assert arrays['indptr'][-1] == len(network.synapses)
+    assert csr_edges(arrays) == synapse_edges(network)
+
+
+def test_csr_empty_rows(tmp_path):
+    filename = tmp_path/'network.csv'
+    filename.write_text(NETWORK_CSV)
+    network = csv2celldl.load_network(str(filename))
+    arrays = csv2celldl.load_csr(network.write_csr(str(tmp_path/'csr')))
+    names = [str(name) for name in arrays['neurons']['name']]
+    row = names.index('C')
+    assert arrays['indptr'][row] == arrays['indptr'][row + 1]
+    assert sum(1 for w in arrays['weight'] if math.isnan(w)) == 1
+
+# -----------------------------------------------------------------------------
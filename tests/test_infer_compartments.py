@@ -0,0 +1,131 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import random
+
+from sbgnml_extract import Diagnostics, SBGN_ML, SpatialIndex, extent_contains
+
+# -----------------------------------------------------------------------------
+
+def glyph(id, cls, x, y, w, h, compartment=None):
+    return ('<glyph id="{}" class="{}"{}><label text="{}"/><bbox x="{}" y="{}" w="{}" h="{}"/></glyph>'
+            .format(id, cls, ' compartmentRef="{}"'.format(compartment) if compartment else '',
+                    id.upper(), x, y, w, h))
+
+
+def load(glyphs):
+    diagnostics = Diagnostics()
+    document = ('<sbgn xmlns="http://sbgn.org/libsbgn/0.2"><map language="process description">'
+                '{}</map></sbgn>'.format(''.join(glyphs)))
+    sbgn = SBGN_ML(document.encode('utf-8'), infer_compartments=True, diagnostics=diagnostics)
+    return ({g.guid: g for g in sbgn.glyphs}, diagnostics)
+
+
+def parent(glyphs, guid):
+    p = glyphs[guid].parent
+    return p.guid if p is not None else None
+
+
+def warnings(diagnostics, code):
+    return [details for (severity, c, details, count) in diagnostics.issues()
+                    if severity == Diagnostics.WARNING and c == code]
+
+# -----------------------------------------------------------------------------
+
+def test_spatial_index():
+    rng = random.Random(1)
+    items = []
+    for n in range(200):
+        (x, y) = (rng.uniform(0, 1000), rng.uniform(0, 1000))
+        (w, h) = (rng.uniform(1, 300), rng.uniform(1, 300))
+        items.append(((x, y, x + w, y + h), n))
+    index = SpatialIndex(items, node_size=4)
+    # Items have been packed into more than one level
+    assert all(node[1] is not None for node in index._root[1])
+    for n in range(50):
+        (x, y) = (rng.uniform(0, 1000), rng.uniform(0, 1000))
+        query = (x, y, x + rng.uniform(0, 20), y + rng.uniform(0, 20))
+        assert (sorted(index.containing(query))
+             == sorted(value for (extent, value) in items if extent_contains(extent, query)))
+
+
+def test_empty_spatial_index():
+    assert SpatialIndex([]).containing((0, 0, 1, 1)) == []
+
+
+def test_nested_compartments():
+    (glyphs, diagnostics) = load([glyph('m', 'macromolecule', 300, 300, 20, 10),
+                                  glyph('inner', 'compartment', 250, 250, 100, 100),
+                                  glyph('middle', 'compartment', 200, 200, 400, 400),
+                                  glyph('outer', 'compartment', 0, 0, 1000, 1000)])
+    assert parent(glyphs, 'm') == 'inner'
+    assert parent(glyphs, 'inner') == 'middle'
+    assert parent(glyphs, 'middle') == 'outer'
+    assert parent(glyphs, 'outer') is None
+    assert diagnostics.warnings == 0
+
+
+def test_equal_area_compartments():
+    # Neither compartment encloses the other, but each encloses the glyph
+    (glyphs, diagnostics) = load([glyph('a', 'compartment', 0, 0, 100, 100),
+                                  glyph('b', 'compartment', 0, 0, 100, 100),
+                                  glyph('m', 'macromolecule', 10, 10, 20, 10)])
+    assert parent(glyphs, 'a') is None and parent(glyphs, 'b') is None
+    assert parent(glyphs, 'm') in ['a', 'b']
+
+
+def test_compartment_conflict():
+    (glyphs, diagnostics) = load([glyph('a', 'compartment', 0, 0, 100, 100),
+                                  glyph('b', 'compartment', 200, 0, 100, 100),
+                                  glyph('m', 'macromolecule', 10, 10, 20, 10, 'b')])
+    # An explicit compartmentRef is kept
+    assert parent(glyphs, 'm') == 'b'
+    assert warnings(diagnostics, 'compartment-conflict') == [
+        dict(glyph='m', compartment='b', enclosing='a')]
+
+
+def test_compartment_cycle():
+    # ``outer`` says it is in ``inner``, which it encloses, so ``inner``
+    # can't also be placed in ``outer``
+    (glyphs, diagnostics) = load([glyph('outer', 'compartment', 0, 0, 1000, 1000, 'inner'),
+                                  glyph('inner', 'compartment', 100, 100, 100, 100)])
+    assert parent(glyphs, 'outer') == 'inner'
+    assert parent(glyphs, 'inner') is None
+    assert len(warnings(diagnostics, 'compartment-conflict')) == 1
+
+
+def test_many_compartments():
+    # More compartments than fit in an index node (of 8), so they are packed
+    # into a tree, each with a glyph
+    size = 5
+    glyphs = [glyph('outer', 'compartment', 0, 0, 200*size, 200*size)]
+    for row in range(size):
+        for column in range(size):
+            (x, y) = (200*column + 10, 200*row + 10)
+            glyphs.append(glyph('c{}_{}'.format(row, column), 'compartment', x, y, 150, 150))
+            glyphs.append(glyph('m{}_{}'.format(row, column), 'macromolecule', x + 50, y + 50, 40, 20))
+    (glyphs, diagnostics) = load(glyphs)
+    for row in range(size):
+        for column in range(size):
+            assert parent(glyphs, 'm{}_{}'.format(row, column)) == 'c{}_{}'.format(row, column)
+            assert parent(glyphs, 'c{}_{}'.format(row, column)) == 'outer'
+    assert diagnostics.warnings == 0
+
+# -----------------------------------------------------------------------------
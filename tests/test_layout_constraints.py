@@ -0,0 +1,39 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import sbgnml_extract
+
+from test_overview import UNCLASSIFIED_PROCESSES, load_sbgn
+
+# -----------------------------------------------------------------------------
+
+def test_separations_between_connected_glyphs(tmp_path):
+    # Processes are filtered out, so separations come from their connections
+    sbgn = load_sbgn(tmp_path, UNCLASSIFIED_PROCESSES)
+    j = sbgn.to_json(sbgnml_extract.CLASS_LIST)
+    names = [n['name'] for n in j['nodes']]
+    separations = [(names[c['left']], names[c['right']]) for c in j['constraints']
+                                                          if 'gap' in c and c['gap'] > 0]
+    # M1 is above M2 in the same compartment
+    assert ('M1', 'M2') in separations
+    assert all(c['axis'] == 'y' for c in j['constraints']
+                                 if 'gap' in c and c['gap'] > 0)
+
+# -----------------------------------------------------------------------------
@@ -0,0 +1,112 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+import json
+
+import pytest
+
+import celldl_reader
+import csv2celldl
+import sbgnml_extract
+
+from test_convert_many import CONNECTIVITY_CSV, sbgn_document
+
+# -----------------------------------------------------------------------------
+
+# The viewer identifies a connection by its ends and classes, so an overview
+# can't have two connections with the same ones
+
+def check_overview(celldl):
+    diagram = celldl_reader.read_string(celldl)
+    assert diagram.validate() == []
+    keys = [(c.source, c.target, tuple(c.classes)) for c in diagram.connections]
+    assert len(keys) == len(set(keys))
+    return diagram
+
+
+def overview_celldl(files):
+    return [text for (filename, text) in files.items() if filename.endswith('-overview.celldl')][0]
+
+# -----------------------------------------------------------------------------
+
+# Two unclassified process types joining the same compartments, along with
+# a process within a compartment
+
+UNCLASSIFIED_PROCESSES = b'''<?xml version="1.0" encoding="UTF-8"?>
+<sbgn xmlns="http://sbgn.org/libsbgn/0.2"
+      xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+      xmlns:bqbiol="http://biomodels.net/biology-qualifiers/">
+  <map language="process description">
+    <glyph id="a" class="compartment"><label text="A"/><bbox x="0" y="0" w="400" h="400"/></glyph>
+    <glyph id="b" class="compartment"><label text="B"/><bbox x="500" y="0" w="400" h="400"/></glyph>
+    <glyph id="m1" class="macromolecule" compartmentRef="a"><label text="M1"/><bbox x="50" y="50" w="60" h="30"/></glyph>
+    <glyph id="m2" class="macromolecule" compartmentRef="a"><label text="M2"/><bbox x="50" y="250" w="60" h="30"/></glyph>
+    <glyph id="m3" class="macromolecule" compartmentRef="b"><label text="M3"/><bbox x="550" y="50" w="60" h="30"/></glyph>
+    <glyph id="p1" class="process"><bbox x="300" y="50" w="10" h="10"/>
+      <annotation><rdf:RDF><rdf:Description rdf:about="#p1">
+        <bqbiol:is><rdf:Bag><rdf:li rdf:resource="http://identifiers.org/GO:0000001"/></rdf:Bag></bqbiol:is>
+      </rdf:Description></rdf:RDF></annotation></glyph>
+    <glyph id="p2" class="process"><bbox x="300" y="250" w="10" h="10"/>
+      <annotation><rdf:RDF><rdf:Description rdf:about="#p2">
+        <bqbiol:is><rdf:Bag><rdf:li rdf:resource="http://identifiers.org/GO:0000002"/></rdf:Bag></bqbiol:is>
+      </rdf:Description></rdf:RDF></annotation></glyph>
+    <glyph id="p3" class="process"><bbox x="100" y="150" w="10" h="10"/></glyph>
+    <arc id="a1" class="consumption" source="m1" target="p1"/>
+    <arc id="a2" class="production" source="p1" target="m3"/>
+    <arc id="a3" class="consumption" source="m2" target="p2"/>
+    <arc id="a4" class="production" source="p2" target="m3"/>
+    <arc id="a5" class="consumption" source="m1" target="p3"/>
+    <arc id="a6" class="production" source="p3" target="m2"/>
+  </map>
+</sbgn>'''
+
+
+def load_sbgn(tmp_path, document):
+    filename = str(tmp_path/'map.sbgn')
+    with open(filename, 'wb') as f:
+        f.write(document)
+    return sbgnml_extract.load_sbgnml(filename)
+
+# -----------------------------------------------------------------------------
+
+@pytest.mark.parametrize('depth', [0, 1, 2, 3])
+def test_network_overview(depth):
+    network = csv2celldl.load_network(CONNECTIVITY_CSV)
+    diagram = check_overview(overview_celldl(network.to_overview('network', depth)))
+    groups = set(g.id for g in network.components if isinstance(g, csv2celldl.Group))
+    for c in diagram.connections:
+        assert c.source != c.target or c.source not in groups
+
+
+@pytest.mark.parametrize('depth', [0, 1, 2])
+def test_sbgn_overview(tmp_path, depth):
+    sbgn = load_sbgn(tmp_path, sbgn_document(10))
+    check_overview(overview_celldl(sbgn.to_overview('map', depth, sbgnml_extract.CLASS_LIST)))
+
+
+def test_sbgn_overview_aggregation(tmp_path):
+    sbgn = load_sbgn(tmp_path, UNCLASSIFIED_PROCESSES)
+    files = sbgn.to_overview('map', 0, sbgnml_extract.CLASS_LIST)
+    diagram = check_overview(overview_celldl(files))
+    assert [(c.source, c.target, c.attributes['count']) for c in diagram.connections] == [('A', 'B', '2')]
+    nodes = {n['id']: n for n in json.loads(files['map-overview.json'])['nodes']}
+    assert nodes['A']['internal'] == 1
+
+# -----------------------------------------------------------------------------
@@ -0,0 +1,83 @@
+# -----------------------------------------------------------------------------
+#
+#  Cell Diagramming Language
+#
+#  Copyright (c) 2018  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# -----------------------------------------------------------------------------
+
+from lxml import etree
+
+from svg_optimise import round_numbers, optimise_svg, TRANSFORM_SIGNIFICANT_DIGITS
+
+# -----------------------------------------------------------------------------
+
+def test_rounding_keeps_numbers_apart():
+    assert round_numbers('M1.001.5L2 3', 2) == 'M1 .5L2 3'
+    assert round_numbers('M1.5.001', 2) == 'M1.5 0'
+    assert round_numbers('M1.25.5-2', 2) == 'M1.25.5-2'
+    # Arc flags are left alone
+    assert round_numbers('a1 1 0 011.5 2', 2) == 'a1 1 0 011.5 2'
+
+
+def test_rounding_transforms():
+    assert round_numbers('scale(0.004)', 2, TRANSFORM_SIGNIFICANT_DIGITS) == 'scale(.004)'
+    assert (round_numbers('matrix(0.70710678 0 0 0.70710678 1234.5678 0)', 2, TRANSFORM_SIGNIFICANT_DIGITS)
+            == 'matrix(.707107 0 0 .707107 1234.57 0)')
+
+
+def test_optimised_transform():
+    svg = b'''<svg xmlns="http://www.w3.org/2000/svg">
+        <g transform="scale(0.004)"><path d="M1.001.5L2 3"/></g>
+    </svg>'''
+    root = etree.fromstring(optimise_svg(svg))
+    group = root[0]
+    assert group.get('transform') == 'scale(.004)'
+    assert group[0].get('d') == 'M1 .5L2 3'
+
+
+
+def test_id_selectors_are_references():
+    svg = b'''<svg xmlns="http://www.w3.org/2000/svg">
+        <style>#lung{fill:red}</style>
+        <path id="lung" d="M0 0h10v10z"/><path id="unused" d="M20 0h10v10z"/>
+    </svg>'''
+    root = etree.fromstring(optimise_svg(svg, merge_paths=False, keep_ids=[]))
+    assert [e.get('id') for e in root.iter('{http://www.w3.org/2000/svg}path')] == ['lung', None]
+
+
+def merged_paths(paths, attributes=''):
+    svg = '<svg xmlns="http://www.w3.org/2000/svg"><g {}>{}</g></svg>'.format(attributes,
+            ''.join('<path fill="red" d="{}"/>'.format(d) for d in paths))
+    root = etree.fromstring(optimise_svg(svg.encode('utf-8')))
+    return [e.get('d') for e in root.iter('{http://www.w3.org/2000/svg}path')]
+
+
+def test_merging_filled_paths():
+    # Overlapping subpaths of opposite winding would leave a hole
+    assert len(merged_paths(['M0 0h50v50h-50z', 'M25 25v50h50v-50z'])) == 2
+    assert merged_paths(['M0 0h50v50h-50z', 'm60 0 10 0 0 10z']) == ['M0 0h50v50h-50z M60 0l 10 0 0 10z']
+    # Arcs have no known bounds
+    assert len(merged_paths(['M0 0h50v50h-50z', 'M100 100a5 5 0 010 10z'])) == 2
+
+
+def test_merging_stroked_paths():
+    svg = b'''<svg xmlns="http://www.w3.org/2000/svg"><g fill="none" stroke="black">
+        <path d="M0 0h50v50h-50z"/><path d="M25 25v50h50v-50z"/>
+    </g></svg>'''
+    root = etree.fromstring(optimise_svg(svg))
+    assert len(list(root.iter('{http://www.w3.org/2000/svg}path'))) == 1
+
+# -----------------------------------------------------------------------------